@@ -188,8 +188,8 @@ class KeysFrame(CardFrame.CardFrameChild):
                     ',typeEntity=' + typeEntity +
                     ',file=' + file)
 
-            mealy = Mealy.Mealy(key, self.root.config, typeEntity, file, self.verbose)
-            mealy.genAlphabetMatrixes()
+            mealy = Mealy.machineCache.get(key, self.root.config,
+                                           typeEntity, file, self.verbose)
             if not mealy.isReady() :
                 raise ValueError(_("Mealy machine not ready !"))
             self.root.mealy = mealy
@@ -35,13 +35,94 @@ Copyright (c) 2015 - Thierry Maillard
 *********************************************************
 """
 
+import array
+import collections
+import functools
+import itertools
+import hashlib
+import mmap
+import os
 import random
-import copy
+import re
 import string
+import struct
+import sys
+import threading
+import time
+import zlib
+
+# concurrent.futures is imported by the functions using pools of
+# threads or processes : its import is the slowest of the standard ones.
+
+# Optional module used by cipherMany(), deCipherMany() and to generate
+# large tables : imported on first use by importNumpy(), its import time
+# would dominate batch mode startup. False : not imported yet.
+numpy = False
+
+# Compiled machine file : header, alphabet in utf-8 padded to 4 bytes,
+# packed encoding table then packed decoding table (little endian uint32).
+# Header : magic, version, reserved, nbState, nbChar,
+# SHA-256 of Mealy.getCacheKey(), alphabet size in bytes,
+# CRC32 of alphabet and tables.
+MACHINE_FILE_MAGIC = b'MEALYMC\0'
+MACHINE_FILE_VERSION = 1
+MACHINE_FILE_HEADER = struct.Struct('<8sHHII32sII')
+
+# Number of chars read and processed at once by cipherFiles()
+FILE_CHUNK_SIZE = 1 << 20
+
+# cipherMany() : texts longer than MANY_MAX_LENGTH are processed one by one,
+# others by groups of similar lengths with a grid of at most MANY_GRID_CELLS
+# chars, groups of less than MANY_MIN_TEXTS texts are processed one by one
+MANY_MAX_LENGTH = 4096
+MANY_GRID_CELLS = 1 << 22
+MANY_MIN_TEXTS = 16
+
+# Min number of cells of tables for which numpy key schedule is used :
+# for smaller tables, importing numpy costs more than it saves
+NUMPY_KEY_SCHEDULE_MIN_CELLS = 1 << 16
+
+def importNumpy():
+    """
+    Return numpy module imported on first call, None if it is not installed.
+    """
+    global numpy # pylint: disable=global-statement
+    if numpy is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+def timedPhase(method):
+    """
+    Decorator of Mealy methods : wall and CPU time of each call
+    are added to self.stats (see MealyStats) when it is set.
+    """
+    @functools.wraps(method)
+    def timedMethod(self, *args, **kwargs):
+        if self.stats is None:
+            return method(self, *args, **kwargs)
+        return timedCall(self.stats, method.__name__, method, self,
+                         *args, **kwargs)
+    return timedMethod
+
+def timedCall(stats, phase, function, *args, **kwargs):
+    """
+    Return function(*args, **kwargs), wall and CPU time of the call
+    are added to stats (see MealyStats) as phase.
+    """
+    startWall = time.perf_counter()
+    startCpu = time.process_time()
+    result = function(*args, **kwargs)
+    stats.addPhase(phase, time.perf_counter() - startWall,
+                   time.process_time() - startCpu)
+    return result
 
 class Mealy:
     """ Cipher / decipher a text using a Mealy machine. """
-    def __init__(self, key, config, typeEntity, file="", verbose=False):
+    def __init__(self, key, config, typeEntity, file="", verbose=False,
+                 compact=False, direction='both'):
         """
         Create a new Mealy machine according parameters :
             - key : the seed value for random numbers generators
@@ -52,6 +133,14 @@ class Mealy:
             * 'string' -> 'printable' + letters from string file at the beginning
             * 'file' ->  'printable' + characters found in local file at the beginning
             - verbose : (default False), if True print debug information
+            - compact : (default False), if True tables are packed in flat
+                arrays (CompactMachine) : less memory per machine,
+                but about 2 times slower per char
+            - direction : tables to build
+            * 'both' (default) -> decoding tables are built on first use
+            * 'cipher' -> cipher only, decoding tables are never built
+            * 'decipher' -> decipher only, encoding tables are dropped
+                once decoding tables are built
         """
 
         # Test parameters
@@ -69,6 +158,9 @@ class Mealy:
         allowedTypeEntity = ('test', 'printable', 'string', 'file')
         if typeEntity not in allowedTypeEntity:
             raise ValueError(f'typeEntity not in {allowedTypeEntity}')
+        allowedDirection = ('both', 'cipher', 'decipher')
+        if direction not in allowedDirection:
+            raise ValueError(f'direction not in {allowedDirection}')
 
         # Register parameters
         self.key = key
@@ -82,6 +174,27 @@ class Mealy:
         if self.nbState < 3 :
             raise ValueError('Number of state too low (min 3)'
                              f': {self.nbState}')
+        # Version 1 : tables generated at once from key
+        # Version 2 : each row generated from key on first visit
+        self.machineVersion = config.getint("MealyMachine", "machineVersion",
+                                            fallback=1)
+        if self.machineVersion not in (1, 2) :
+            raise ValueError('Unknown machine version : '
+                             f'{self.machineVersion}')
+        self.rowCacheSize = config.getint("MealyMachine", "rowCacheSize",
+                                          fallback=4096)
+        if self.rowCacheSize < 1 :
+            raise ValueError('Row cache size must be positive : '
+                             f'{self.rowCacheSize}')
+        # Runs of whitespaces or runChars processed in one step,
+        # 0 : no run processing
+        self.minRunLength = config.getint("MealyMachine", "minRunLength",
+                                          fallback=0)
+        if self.minRunLength < 0 :
+            raise ValueError('Min run length must not be negative : '
+                             f'{self.minRunLength}')
+        self.runChars = string.whitespace + config.get("MealyMachine",
+                                                       "runChars", fallback="")
 
         self.file = file
         self.verbose = verbose
@@ -89,6 +202,19 @@ class Mealy:
         self.TTe = []
         self.TCd = []
         self.TTd = []
+        self.machineClass = CompactMachine if compact else CompiledMachine
+        self.direction = direction
+        self.machineEncoding = None
+        self.machineDecoding = None
+        # Built on first use by getSanitizer()
+        self.sanitizer = None
+        # MealyStats to record timing and counters, None : no recording
+        self.stats = None
+        # MealyProfile to record states visited by cipher() and deCipher(),
+        # None : no recording
+        self.profile = None
+        # Protect lazy building of decoding tables
+        self.lock = threading.Lock()
         self.ready = False
 
         if self.verbose :
@@ -97,22 +223,262 @@ class Mealy:
             print('nbState :', self.nbState)
             print('typeEntity :', self.typeEntity)
             print('file :', self.file)
+            print('direction :', self.direction)
+            print('machineVersion :', self.machineVersion)
 
     def genAlphabetMatrixes(self) :
         """
         Generate alphabet and matrixes,
         must be called before cipher and decipher methods.
+        Decoding matrixes are generated now only for a decipher only machine,
+        else on first use.
         """
 
         self.alphabet = self.setAlphabet()
+        if self.machineVersion == 2:
+            # Rows are generated on first use, no table to build now
+            self.machineEncoding = self.machineDecoding = None
+            if self.direction != 'decipher':
+                self.machineEncoding = LazyRowMachine(
+                    self.alphabet, self.key, self.nbState, self.rowCacheSize)
+            if self.direction != 'cipher':
+                self.machineDecoding = LazyRowMachine(
+                    self.alphabet, self.key, self.nbState, self.rowCacheSize,
+                    decoding=True)
+            self.ready = True
+            return
+
         self.setMatrixEncoding()
+        self.machineEncoding = self.compileMachine(self.TTe, self.TCe)
+        self.machineDecoding = None
+        # Matrixes are now owned by the compiled machines
+        self.TTe, self.TCe, self.TTd, self.TCd = [], [], [], []
+        if self.direction == 'decipher':
+            self.machineDecoding = self.buildMachineDecoding()
+            self.machineEncoding = None
+        self.ready = True
+
+    def buildMachineDecoding(self) :
+        """
+        Return a new compiled machine for decoding
+        built from the encoding one.
+        """
+        self.TTe, self.TCe = self.machineEncoding.getMatrixes()
         self.setMatrixDecoding()
+        machineDecoding = self.compileMachine(self.TTd, self.TCd)
+        self.TTe, self.TCe, self.TTd, self.TCd = [], [], [], []
+        return machineDecoding
+
+    def compileMachine(self, TT, TC) :
+        """
+        Return a new machine of machineClass for alphabet, TT and TC.
+        """
+        machine = self.machineClass.fromMatrixes(self.alphabet, TT, TC)
+        if self.minRunLength:
+            machine.setRuns(self.runChars, self.minRunLength)
+        return machine
+
+    def getMachineEncoding(self) :
+        """
+        Return compiled machine used by cipher methods.
+        """
+        if self.machineEncoding is None:
+            if self.ready:
+                raise ValueError('Mealy machine built for deciphering only')
+            raise ValueError('Mealy machine not ready, '
+                             'call genAlphabetMatrixes() first')
+        return self.machineEncoding
+
+    def getMachineDecoding(self, stats=None) :
+        """
+        Return compiled machine used by decipher methods,
+        built on first call.
+        stats : MealyStats of the caller where building is timed
+                as setMatrixDecoding phase, default self.stats
+        """
+        if self.machineDecoding is None and self.direction == 'both':
+            with self.lock:
+                if (self.machineDecoding is None
+                        and self.machineEncoding is not None):
+                    if stats is None or stats is self.stats:
+                        self.machineDecoding = self.buildMachineDecoding()
+                    else: # Shared machine without stats of the caller
+                        self.machineDecoding = timedCall(
+                            stats, 'setMatrixDecoding',
+                            self.buildMachineDecoding)
+        if self.machineDecoding is None:
+            if self.ready:
+                raise ValueError('Mealy machine built for ciphering only')
+            raise ValueError('Mealy machine not ready, '
+                             'call genAlphabetMatrixes() first')
+        return self.machineDecoding
+
+    def getKeyDigest(self):
+        """
+        Return SHA-256 digest of getCacheKey() :
+        identifies the tables without revealing keys.
+        """
+        return hashlib.sha256(repr(self.getCacheKey()).encode('utf8')).digest()
+
+    @timedPhase
+    def saveMachine(self, fileName) :
+        """
+        Save alphabet and tables of this ready machine in a compiled
+        machine file that can be loaded by loadMachine().
+        Tables are equivalent to keys : file is only readable by its owner.
+        """
+        if self.verbose :
+            print('\nsaveMachine :', fileName)
+        if self.machineVersion != 1:
+            raise ValueError('Only tables of machine version 1 can be saved')
+
+        alphabetBytes = "".join(self.alphabet).encode('utf8')
+        padding = b'\0' * (-len(alphabetBytes) % 4)
+        tables = []
+        for machine in (self.getMachineEncoding(), self.getMachineDecoding()):
+            table = array.array('I', machine.getTable())
+            if sys.byteorder != 'little':
+                table.byteswap()
+            tables.append(table.tobytes())
+        checksum = zlib.crc32(alphabetBytes)
+        for table in tables:
+            checksum = zlib.crc32(table, checksum)
+        header = MACHINE_FILE_HEADER.pack(MACHINE_FILE_MAGIC,
+                                          MACHINE_FILE_VERSION, 0,
+                                          self.nbState, len(self.alphabet),
+                                          self.getKeyDigest(),
+                                          len(alphabetBytes), checksum)
+        try :
+            fd = os.open(fileName, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with open(fd, 'wb') as outfile:
+                outfile.write(header)
+                outfile.write(alphabetBytes + padding)
+                for table in tables:
+                    outfile.write(table)
+        except OSError as exc:
+            raise ValueError(f'Unable to write file {fileName}') from exc
+
+    @timedPhase
+    def loadMachine(self, fileName) :
+        """
+        Load alphabet and tables from a compiled machine file written
+        by saveMachine() for the same keys, instead of genAlphabetMatrixes().
+        File is mapped in memory : with compact tables, they are used
+        in place without copy.
+        """
+        if self.verbose :
+            print('\nloadMachine :', fileName)
+        if self.machineVersion != 1:
+            raise ValueError('Only tables of machine version 1 can be loaded')
+
+        try :
+            with open(fileName, 'rb') as infile:
+                fileMap = mmap.mmap(infile.fileno(), 0,
+                                    access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as exc:
+            raise ValueError(f'Unable to read file {fileName}') from exc
+
+        if len(fileMap) < MACHINE_FILE_HEADER.size:
+            raise ValueError(f'{fileName} is not a compiled machine file')
+        (magic, version, __, nbState, nbChar, keyDigest,
+         alphabetSize, checksum) = MACHINE_FILE_HEADER.unpack_from(fileMap)
+        if magic != MACHINE_FILE_MAGIC:
+            raise ValueError(f'{fileName} is not a compiled machine file')
+        if version != MACHINE_FILE_VERSION:
+            raise ValueError(f'Unsupported version {version} '
+                             f'of compiled machine file {fileName}')
+        if nbState != self.nbState or keyDigest != self.getKeyDigest():
+            raise ValueError(f'{fileName} was not compiled '
+                             'for these keys and parameters')
+        start = MACHINE_FILE_HEADER.size
+        tablesStart = start + alphabetSize + (-alphabetSize % 4)
+        tableSize = 4 * nbState * nbChar
+        if len(fileMap) != tablesStart + 2 * tableSize:
+            raise ValueError(f'Bad size of compiled machine file {fileName}')
+
+        content = memoryview(fileMap)
+        alphabetBytes = content[start:start + alphabetSize]
+        computedChecksum = zlib.crc32(alphabetBytes)
+        computedChecksum = zlib.crc32(content[tablesStart:], computedChecksum)
+        if computedChecksum != checksum:
+            raise ValueError(f'Bad checksum of compiled machine file {fileName}')
+        alphabet = list(bytes(alphabetBytes).decode('utf8'))
+        if len(alphabet) != nbChar:
+            raise ValueError(f'Bad alphabet in compiled machine file {fileName}')
+
+        machines = [None, None]
+        for numTable, tableStart in enumerate((tablesStart,
+                                               tablesStart + tableSize)):
+            if self.direction == ('decipher', 'cipher')[numTable]:
+                continue
+            table = content[tableStart:tableStart + tableSize]
+            if sys.byteorder == 'little':
+                table = table.cast('I')
+            else:
+                table = array.array('I', table)
+                table.byteswap()
+            machines[numTable] = self.machineClass.fromTable(alphabet, table)
+        self.alphabet = alphabet
+        if self.minRunLength:
+            for machine in machines:
+                if machine is not None:
+                    machine.setRuns(self.runChars, self.minRunLength)
+        self.machineEncoding, self.machineDecoding = machines
+        self.TTe, self.TCe, self.TTd, self.TCd = [], [], [], []
         self.ready = True
 
     def isReady(self) :
         """ Return True if Mealy machine is ready to be used. """
         return self.ready
 
+    def getAllowedChars(self):
+        """
+        Return the string of allowed chars according typeEntity and config.
+        """
+        allowedChars = ("abcd" if self.typeEntity == 'test'
+                        else (string.printable +
+                        self.config.get("MealyMachine", "allowedCharsExt")))
+
+        # Suppress strange chars that don't work and cause me a lot of problems
+        for char in "\x0b\x0c…œæŒÆ\r":
+            allowedChars = allowedChars.replace(char, '')
+
+        assert len(allowedChars) > 3, \
+               f'alphabet is too tiny : {allowedChars}'
+        if len(allowedChars) != len(set(allowedChars)):
+            duplicateChars = [char for char in allowedChars
+                              if allowedChars.count(char) != 1]
+            raise ValueError("Duplicate chars in allowedChars : "
+                             f"{duplicateChars}")
+        return allowedChars
+
+    def getCacheKey(self):
+        """
+        Return a tuple identifying the tables of this machine :
+        (key, typeEntity, string key or hash of key file content,
+        nbState, allowedChars)
+        """
+        keyContent = self.file
+        if self.typeEntity == 'file':
+            keyContent = fileHash(self.file, self.verbose)
+        elif self.typeEntity != 'string':
+            keyContent = ''
+        cacheKey = (self.key, self.typeEntity, keyContent,
+                    self.nbState, self.getAllowedChars())
+        if self.machineVersion != 1:
+            cacheKey += (self.machineVersion,)
+        return cacheKey
+
+    def getEngineOptions(self):
+        """
+        Return a tuple of options of the engine processing the tables :
+        (machineVersion, rowCacheSize, minRunLength, runChars)
+        """
+        return (self.machineVersion, self.rowCacheSize, self.minRunLength,
+                self.runChars)
+
+    @timedPhase
     def setAlphabet(self):
         """
         Return alphabet : a list of no duplicate and allowed chars
@@ -131,42 +497,26 @@ class Mealy:
             print('typeEntity :', self.typeEntity)
             print('file :', self.file)
 
-        allowedChars = ("abcd" if self.typeEntity == 'test'
-                        else (string.printable +
-                        self.config.get("MealyMachine", "allowedCharsExt")))
-
-        # Suppress strange chars that don't work and cause me a lot of problems
-        for char in "\x0b\x0c…œæŒÆ\r":
-            allowedChars = allowedChars.replace(char, '')
-
-        assert len(allowedChars) > 3, \
-               f'alphabet is too tiny : {allowedChars}'
-        if len(allowedChars) != len(set(allowedChars)):
-            duplicateChars = [char for char in allowedChars
-                              if allowedChars.count(char) != 1]
-            raise ValueError("Duplicate chars in allowedChars : "
-                             f"{duplicateChars}")
+        allowedChars = self.getAllowedChars()
 
         # Page string gives chars to put first in alphabet
-        page = ""
-        if self.typeEntity in ['file', 'string'] :
-            if self.typeEntity == 'file' :
-                page = fileReader(self.file, self.verbose)
-            else :
-                page = self.file
+        lettersInPage = []
+        if self.typeEntity == 'file' :
+            lettersInPage = fileLettersReader(self.file, allowedChars,
+                                              self.verbose)
+        elif self.typeEntity == 'string' :
+            lettersInPage = pageLetters([self.file], allowedChars)
 
         # Build Alphabet with chars in page first
-        lettersInPage = [char for char in page if char in allowedChars]
-        lettersInPage.extend(allowedChars)
-        alphabet = []
-        for char in lettersInPage:
-            if char not in alphabet:
-                alphabet.extend(char)
+        alphabet = list(lettersInPage)
+        alphabet.extend(char for char in allowedChars
+                        if char not in lettersInPage)
 
         if self.verbose :
             print(f'setAlphabet() : alphabet : {self.alphabet}')
         return alphabet
 
+    @timedPhase
     def setMatrixEncoding(self):
         """
         Generate coding matrixes : TTe (Transition Table) and TCe (Coding Table)
@@ -178,28 +528,14 @@ class Mealy:
             print('nbState :', self.nbState)
             print('alphabet :', "".join(self.alphabet))
 
-        # Set the seed of random generator to be able to reproduce permutations
-        random.seed(self.key)
-        nbChar = len(self.alphabet)
-
-        self.TTe = []
-        listStateStart = list(range(self.nbState))
-        for __ in range(self.nbState):
-            listState = []
-            for __ in range(nbChar):
-                listState.append(random.choice(listStateStart))
-            self.TTe.append(listState)
-
-        self.TCe = []
-        splittedAlphabet = []
-        splittedAlphabet.extend(self.alphabet)
-        # ! list() to avoid parameter splittedAlphabet modification
-        # if multiple calls of this function
-        listChar = list(splittedAlphabet)
-        for __ in range(self.nbState) :
-            random.shuffle(listChar)
-            # ! list() to avoid the copy of the reference only
-            self.TCe.append(list(listChar))
+        # Random tables of states and of positions in alphabet only depend
+        # on key, nbState and alphabet size : alphabet order just relabels
+        # positions, so tables are shared by machines using the same key
+        TTIndexes, TCIndexes = encodingIndexes(self.key, self.nbState,
+                                               len(self.alphabet))
+        self.TTe = [list(rowTT) for rowTT in TTIndexes]
+        self.TCe = [[self.alphabet[position] for position in rowTC]
+                    for rowTC in TCIndexes]
         assert len(self.TTe) == len(self.TCe), \
                ('TTe and TCe must have the same number of states : '
                 f'(len({self.TTe}) and {len(self.TCe)}')
@@ -215,8 +551,11 @@ class Mealy:
         """
         Return curent encoding matrixes TTe and TCe.
         """
+        if self.machineEncoding is not None:
+            return self.machineEncoding.getMatrixes()
         return self.TTe, self.TCe
 
+    @timedPhase
     def setMatrixDecoding(self) :
         """
         Generate decoding matrixes : TTd (Transition Table) and TCd (Coding Table) from :
@@ -232,22 +571,28 @@ class Mealy:
                 print('TTe :', self.TTe)
                 print('TCe :', self.TCe)
 
-        nbChar = len(self.alphabet)
-        self.TTd = copy.deepcopy(self.TTe)
-        self.TCd = copy.deepcopy(self.TCe)
-
-        for state in range(self.nbState) :
-            for indiceChar in range(nbChar) :
-                char = self.alphabet[indiceChar]
-                codedChar = self.TCe[state][indiceChar]
-                try :
-                    indiceCodedChar = self.alphabet.index(codedChar)
-                except ValueError as exc:
-                    raise ValueError(f'Pb decoding : {char} '
+        # Each row of TCe is a permutation of alphabet :
+        # decoding rows are built by inverting it
+        charIndex = {char: position
+                     for position, char in enumerate(self.alphabet)}
+        self.TTd = []
+        self.TCd = []
+        for rowTT, rowTC in zip(self.TTe, self.TCe) :
+            rowTTd = [None] * len(self.alphabet)
+            rowTCd = [None] * len(self.alphabet)
+            for char, codedChar, nextState in zip(self.alphabet, rowTC, rowTT) :
+                indiceCodedChar = charIndex.get(codedChar)
+                if indiceCodedChar is None:
+                    raise ValueError(f'Pb decoding : {codedChar} '
                                      'not in allowed alphabet : '
-                                     f'{self.alphabet}') from exc
-                self.TCd[state][indiceCodedChar] = char
-                self.TTd[state][indiceCodedChar] = self.TTe[state][indiceChar]
+                                     f'{self.alphabet}')
+                rowTCd[indiceCodedChar] = char
+                rowTTd[indiceCodedChar] = nextState
+            if None in rowTCd:
+                raise ValueError('Pb decoding : coded chars of a state are not '
+                                 f'a permutation of alphabet : {rowTC}')
+            self.TTd.append(rowTTd)
+            self.TCd.append(rowTCd)
 
         if self.verbose and self.typeEntity == 'test':
             print('TTd :', self.TTd)
@@ -257,26 +602,712 @@ class Mealy:
         """
         Return curent decoding matrixes TTd and TCd.
         """
+        if self.ready and self.direction != 'cipher':
+            return self.getMachineDecoding().getMatrixes()
         return self.TTd, self.TCd
 
-    def cipher(self, text) :
+    def getSanitizer(self):
+        """
+        Return the Sanitizer of the alphabet of this machine.
+        """
+        if not self.ready :
+            raise ValueError('Mealy machine not ready, alphabet not set')
+        if self.sanitizer is None:
+            self.sanitizer = Sanitizer(self.alphabet)
+        return self.sanitizer
+
+    def sanitize(self, text, report=False):
+        """
+        Return text without the chars that are not in alphabet,
+        these chars are ignored by cipher() and deCipher().
+        report : if True, return a tuple (text, drop report),
+                 see Sanitizer.report()
+        """
+        sanitizer = self.getSanitizer()
+        if report :
+            return sanitizer.clean(text), sanitizer.report(text)
+        return sanitizer.clean(text)
+
+    @timedPhase
+    def cipher(self, text, report=False) :
         """
         Cypher a text given in parameter
+        report : if True, return a tuple (ciphered text, drop report)
+                 for chars of text not in alphabet, see Sanitizer.report()
         """
         if self.verbose :
             print('\ncipher()')
 
-        return _mealy(self.alphabet, self.TTe, self.TCe,
-                      text, self.verbose)
+        outputText = _mealy(self.getMachineEncoding(), text, self.verbose)
+        if self.profile is not None:
+            self.profile.record(self.getMachineEncoding(), text)
+        if self.stats is not None:
+            self.stats.countChars(len(text), len(outputText))
+        if report :
+            return outputText, self.getSanitizer().report(text)
+        return outputText
 
-    def deCipher(self, text) :
+    @timedPhase
+    def deCipher(self, text, report=False) :
         """
         Cypher a text given in parameter
+        report : if True, return a tuple (deciphered text, drop report)
+                 for chars of text not in alphabet, see Sanitizer.report()
         """
         if self.verbose :
             print('\ndeCipher()')
-        return _mealy(self.alphabet, self.TTd, self.TCd,
-                      text, self.verbose)
+        outputText = _mealy(self.getMachineDecoding(), text, self.verbose)
+        if self.profile is not None:
+            self.profile.record(self.getMachineDecoding(), text)
+        if self.stats is not None:
+            self.stats.countChars(len(text), len(outputText))
+        if report :
+            return outputText, self.getSanitizer().report(text)
+        return outputText
+
+    @timedPhase
+    def cipherParallel(self, text, jobs, chunkSize=0) :
+        """
+        Cypher a text given in parameter using a pool of jobs processes,
+        result is the same as cipher()
+        """
+        if self.verbose :
+            print('\ncipherParallel()')
+        outputText = _mealyParallel(self.getMachineEncoding(), text, jobs,
+                                    self.verbose, chunkSize)
+        if self.stats is not None:
+            self.stats.countChars(len(text), len(outputText))
+        return outputText
+
+    @timedPhase
+    def deCipherParallel(self, text, jobs, chunkSize=0) :
+        """
+        Decypher a text given in parameter using a pool of jobs processes,
+        result is the same as deCipher()
+        """
+        if self.verbose :
+            print('\ndeCipherParallel()')
+        outputText = _mealyParallel(self.getMachineDecoding(), text, jobs,
+                                    self.verbose, chunkSize)
+        if self.stats is not None:
+            self.stats.countChars(len(text), len(outputText))
+        return outputText
+
+    def cipherFiles(self, files, jobs=1, chunkSize=FILE_CHUNK_SIZE) :
+        """
+        Cypher files given as a list of (input file, output file),
+        each file is processed by chunks from state 0, by a pool of
+        jobs processes. Directories of output files are created.
+        Return a list of error messages, '' for each file processed.
+        """
+        if self.verbose :
+            print('\ncipherFiles()')
+        return _mealyFiles(self.getMachineEncoding(), files, jobs, chunkSize,
+                           self.verbose)
+
+    def deCipherFiles(self, files, jobs=1, chunkSize=FILE_CHUNK_SIZE) :
+        """
+        Decypher files given as a list of (input file, output file),
+        see cipherFiles().
+        """
+        if self.verbose :
+            print('\ndeCipherFiles()')
+        return _mealyFiles(self.getMachineDecoding(), files, jobs, chunkSize,
+                           self.verbose)
+
+    def cipherMany(self, texts) :
+        """
+        Cypher a list of independent texts, return the list of ciphered texts,
+        same results as cipher() called on each text.
+        All texts are processed together with numpy when it is installed.
+        """
+        if self.verbose :
+            print('\ncipherMany()')
+        return _mealyMany(self.getMachineEncoding(), texts, self.verbose)
+
+    def deCipherMany(self, texts) :
+        """
+        Decypher a list of independent texts, return the list of deciphered
+        texts, same results as deCipher() called on each text.
+        All texts are processed together with numpy when it is installed.
+        """
+        if self.verbose :
+            print('\ndeCipherMany()')
+        return _mealyMany(self.getMachineDecoding(), texts, self.verbose)
+
+    def cipherStream(self, chunks) :
+        """
+        Generator : cypher an iterable of text chunks,
+        yield ciphered chunks, state is kept from one chunk to the next.
+        Joined results are the same as cipher() on the whole text.
+        """
+        session = MealySession(self)
+        for chunk in chunks:
+            yield session.feed(chunk)
+
+    def deCipherStream(self, chunks) :
+        """
+        Generator : decypher an iterable of text chunks,
+        yield deciphered chunks, state is kept from one chunk to the next.
+        Joined results are the same as deCipher() on the whole text.
+        """
+        session = MealySession(self, decipher=True)
+        for chunk in chunks:
+            yield session.feed(chunk)
+
+class Sanitizer:
+    """
+    Filter of the chars that are not in an alphabet :
+    a regex of the complement of the alphabet compiled once,
+    so that text is scanned in C, without a Python loop on chars.
+    """
+    # Number of positions of dropped chars given by report()
+    NB_SAMPLES = 10
+
+    def __init__(self, alphabet):
+        """
+        Compile filter for alphabet : allowed chars
+        """
+        self.alphabet = alphabet
+        if alphabet:
+            self.pattern = re.compile(
+                '[^' + ''.join(map(re.escape, alphabet)) + ']')
+        else:
+            self.pattern = re.compile('.', re.DOTALL)
+
+    def clean(self, text):
+        """
+        Return text without the chars that are not in alphabet.
+        """
+        return self.pattern.sub('', text)
+
+    def report(self, text, nbSamples=NB_SAMPLES):
+        """
+        Return a dictionary describing chars of text not in alphabet :
+        - dropped : number of dropped chars
+        - counts : dropped char -> number of occurences
+        - positions : positions in text of the first nbSamples dropped chars
+        Cost is a scan in C plus a small cost per dropped char.
+        """
+        counts = collections.Counter(self.pattern.findall(text))
+        positions = [match.start() for match in
+                     itertools.islice(self.pattern.finditer(text), nbSamples)]
+        return {'dropped': sum(counts.values()),
+                'counts': dict(counts),
+                'positions': positions}
+
+class MealySession:
+    """
+    Cipher / decipher a text given in pieces :
+    the state of the Mealy machine is kept between feed() calls.
+    """
+    def __init__(self, mealy, decipher=False, stats=None):
+        """
+        Start a new session at state 0 :
+        - mealy : Mealy machine ready to be used
+        - decipher : (default False) if True decipher, else cipher
+        - stats : MealyStats of the caller, default stats of mealy
+        """
+        self.machine = (mealy.getMachineDecoding(stats) if decipher
+                        else mealy.getMachineEncoding())
+        self.state = 0
+        # Each chunk is counted as a call of cipher or deCipher phase
+        self.stats = mealy.stats if stats is None else stats
+        self.phase = 'deCipher' if decipher else 'cipher'
+
+    def feed(self, chunk):
+        """
+        Process next chunk of text and return its processed text.
+        """
+        stats = self.stats
+        if stats is None:
+            output, self.state = self.machine.process(chunk, self.state)
+            return output
+        startWall = time.perf_counter()
+        startCpu = time.process_time()
+        output, self.state = self.machine.process(chunk, self.state)
+        stats.addPhase(self.phase, time.perf_counter() - startWall,
+                       time.process_time() - startCpu)
+        stats.countChars(len(chunk), len(output))
+        return output
+
+    def reset(self):
+        """ Restart from state 0 for a new text. """
+        self.state = 0
+
+class MealyStats:
+    """
+    Timing and counters recorded by Mealy machines which stats is set :
+    - wall and CPU time of each phase (setAlphabet, setMatrixEncoding,
+      setMatrixDecoding, cipher, deCipher...), CPU time of the processes
+      of a pool is not counted
+    - chars processed and dropped (not in alphabet)
+    - machine cache hits and misses (see MachineCache.get())
+    Can be shared by several threads.
+    """
+    def __init__(self):
+        """ Create empty stats """
+        # Phase name -> [number of calls, wall time s, CPU time s]
+        self.phases = {}
+        self.charsProcessed = 0
+        self.charsDropped = 0
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.lock = threading.Lock()
+
+    def addPhase(self, name, wallTime, cpuTime):
+        """ Add a call of phase name """
+        with self.lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += 1
+            phase[1] += wallTime
+            phase[2] += cpuTime
+
+    def countChars(self, nbCharsText, nbCharsProcessed):
+        """
+        Count chars of a text : processed chars are output 1 for 1,
+        the others are dropped.
+        """
+        with self.lock:
+            self.charsProcessed += nbCharsProcessed
+            self.charsDropped += nbCharsText - nbCharsProcessed
+
+    def countCache(self, hit):
+        """ Count a machine cache hit if hit is True, else a miss """
+        with self.lock:
+            if hit:
+                self.cacheHits += 1
+            else:
+                self.cacheMisses += 1
+
+    def asDict(self):
+        """ Return stats as a dictionary, ready for json.dumps() """
+        return {'phases': {name: {'calls': calls, 'wall': wallTime,
+                                  'cpu': cpuTime}
+                           for name, (calls, wallTime, cpuTime)
+                           in self.phases.items()},
+                'charsProcessed': self.charsProcessed,
+                'charsDropped': self.charsDropped,
+                'cacheHits': self.cacheHits,
+                'cacheMisses': self.cacheMisses}
+
+    def format(self):
+        """ Return stats as a text table """
+        lines = [f'{"phase":<20} {"calls":>6} {"wall ms":>10} {"cpu ms":>10}']
+        for name, (calls, wallTime, cpuTime) in self.phases.items():
+            lines.append(f'{name:<20} {calls:6d} {wallTime * 1000:10.2f} '
+                         f'{cpuTime * 1000:10.2f}')
+        lines.append(f'chars processed : {self.charsProcessed}')
+        lines.append(f'chars dropped : {self.charsDropped}')
+        lines.append(f'machine cache hits : {self.cacheHits}, '
+                     f'misses : {self.cacheMisses}')
+        return "\n".join(lines)
+
+class MealyProfile:
+    """
+    Profile of the texts processed by machines, recorded in a second
+    pass by record() so that engines are not slowed down when not profiling :
+    - visits : number of steps from each state
+    - transitions : number of steps for each (state, position in alphabet)
+    - maxRuns : longest run of each char of alphabet
+    Used to choose nbState and engine options (rowCacheSize, runChars,
+    minRunLength).
+    """
+    def __init__(self):
+        """ Create an empty profile """
+        self.alphabet = []
+        self.nbChars = 0
+        self.visits = collections.Counter()
+        self.transitions = collections.Counter()
+        self.maxRuns = {}
+        # (position in alphabet, length) of the run ending the last text
+        self.lastRun = (None, 0)
+
+    def record(self, machine, text, state=0, continued=False):
+        """
+        Add steps of machine processing text from state.
+        continued : True if text follows the last recorded text,
+                    as chunks of a file : a run at its start continues
+                    the run at the end of the last text.
+        Return state reached at the end of text.
+        """
+        if self.alphabet and self.alphabet != machine.alphabet:
+            raise ValueError('Profile recorded for another alphabet')
+        self.alphabet = machine.alphabet
+        positions = machine.textPositions(text)
+        states = []
+        for positionInAlphabet in positions:
+            states.append(state)
+            __, state = machine.step(state, positionInAlphabet)
+        self.nbChars += len(positions)
+        self.visits.update(states)
+        self.transitions.update(zip(states, positions))
+        lastPosition, lastLength = self.lastRun if continued else (None, 0)
+        for positionInAlphabet, run in itertools.groupby(positions):
+            runLength = sum(1 for __ in run)
+            if positionInAlphabet == lastPosition:
+                runLength += lastLength
+            lastPosition, lastLength = positionInAlphabet, runLength
+            if runLength > self.maxRuns.get(positionInAlphabet, 0):
+                self.maxRuns[positionInAlphabet] = runLength
+        self.lastRun = (lastPosition, lastLength)
+        return state
+
+    def asDict(self):
+        """
+        Return profile as a dictionary, ready for json.dumps() :
+        counts of visited states and transitions are lists sorted
+        by decreasing count, max runs are given for each char.
+        """
+        return {'nbChars': self.nbChars,
+                'visits': [[state, count] for state, count
+                           in self.visits.most_common()],
+                'transitions': [[state, self.alphabet[positionInAlphabet],
+                                 count]
+                                for (state, positionInAlphabet), count
+                                in self.transitions.most_common()],
+                'maxRuns': {self.alphabet[positionInAlphabet]: runLength
+                            for positionInAlphabet, runLength
+                            in sorted(self.maxRuns.items())}}
+
+    def asArrays(self, nbState):
+        """
+        Return profile as numpy arrays : (visits of each state,
+        transitions matrix nbState x nbChar, max run of each char)
+        """
+        if importNumpy() is None:
+            raise ValueError('numpy is required for asArrays()')
+        nbChar = len(self.alphabet)
+        visits = numpy.zeros(nbState, dtype=numpy.int64)
+        for state, count in self.visits.items():
+            visits[state] = count
+        transitions = numpy.zeros((nbState, nbChar), dtype=numpy.int64)
+        for (state, positionInAlphabet), count in self.transitions.items():
+            transitions[state, positionInAlphabet] = count
+        maxRuns = numpy.zeros(nbChar, dtype=numpy.int64)
+        for positionInAlphabet, runLength in self.maxRuns.items():
+            maxRuns[positionInAlphabet] = runLength
+        return visits, transitions, maxRuns
+
+class MachineCache:
+    """
+    Bounded cache of ready Mealy machines, least recently used are evicted.
+    Machines are identified by Mealy.getCacheKey() and
+    Mealy.getEngineOptions(), so that a machine already built for the same
+    keys and options is reused without generating its tables.
+    Can be shared by several threads.
+    """
+    def __init__(self, maxSize=16):
+        """
+        Create an empty cache :
+        - maxSize : max number of machines kept
+        """
+        if maxSize < 1:
+            raise ValueError(f'Cache size must be positive : {maxSize}')
+        self.maxSize = maxSize
+        self.machines = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, config, typeEntity, file="", verbose=False,
+            stats=None, build=True):
+        """
+        Return a ready Mealy machine for these parameters (see Mealy()),
+        built and registered in cache if not already in it.
+        stats : if set, MealyStats of the caller : cache hit or miss
+                and building of the machine are counted in it.
+                Machines in cache are shared : they have no stats,
+                use MealySession(mealy, stats=stats) to time their use.
+        build : if False, return None if machine is not in cache,
+                a miss is not counted.
+        """
+        mealy = Mealy(key, config, typeEntity, file, verbose)
+        cacheKey = mealy.getCacheKey() + mealy.getEngineOptions()
+        with self.lock:
+            cachedMealy = self.machines.get(cacheKey)
+            if cachedMealy is not None:
+                self.machines.move_to_end(cacheKey)
+                self.hits += 1
+                if stats is not None:
+                    stats.countCache(True)
+                return cachedMealy
+            if not build:
+                return None
+            self.misses += 1
+
+        if stats is not None:
+            stats.countCache(False)
+        mealy.stats = stats
+        mealy.genAlphabetMatrixes()
+        mealy.stats = None
+        with self.lock:
+            self.machines[cacheKey] = mealy
+            self.machines.move_to_end(cacheKey)
+            while len(self.machines) > self.maxSize:
+                self.machines.popitem(last=False)
+        return mealy
+
+    def clear(self):
+        """ Remove all machines and reset counters """
+        with self.lock:
+            self.machines.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        """ Return number of machines in cache """
+        return len(self.machines)
+
+# Cache shared by batch mode and GUI
+machineCache = MachineCache()
+
+# Number of (key, nbState, nbChar) kept by encodingIndexes()
+ENCODING_INDEXES_CACHE_SIZE = 64
+
+@functools.lru_cache(maxsize=ENCODING_INDEXES_CACHE_SIZE)
+def encodingIndexes(key, nbState, nbChar):
+    """
+    Return random tables for Mealy.setMatrixEncoding() as tuples of tuples :
+    - TT : next state for each state and position in alphabet
+    - TC : position in alphabet of coded char for each state and position
+    Results are cached : machines with same key reuse them.
+    Computed with numpy for large tables when it is installed, same results.
+    """
+    if (nbState * nbChar >= NUMPY_KEY_SCHEDULE_MIN_CELLS and
+            importNumpy() is not None and numpyKeyScheduleConforms()):
+        return encodingIndexesNumpy(key, nbState, nbChar)
+    return encodingIndexesRandom(key, nbState, nbChar)
+
+def encodingIndexesRandom(key, nbState, nbChar):
+    """
+    Return random tables of encodingIndexes() computed with module random.
+    """
+    # Private random generator seeded with key to be able to reproduce
+    # permutations : same sequence as random.seed(key) without changing
+    # the module random generator shared with other threads
+    generator = random.Random(key)
+
+    TT = []
+    listStateStart = list(range(nbState))
+    for __ in range(nbState):
+        TT.append(tuple(generator.choice(listStateStart)
+                        for __ in range(nbChar)))
+
+    # Successive shuffles of the same list : a shuffle moves positions
+    # the same way whatever the content of the list
+    TC = []
+    listPosition = list(range(nbChar))
+    for __ in range(nbState) :
+        generator.shuffle(listPosition)
+        TC.append(tuple(listPosition))
+    return tuple(TT), tuple(TC)
+
+class NumpyMersenneTwister:
+    """
+    Mersenne Twister generator of CPython module random computed with numpy :
+    same 32 bits words as random.Random(key).getrandbits(32).
+    State is seeded as module random does, then words are generated
+    in bulk by numpy MT19937 bit generator, same algorithm.
+    """
+    N = 624
+
+    def __init__(self, key):
+        """
+        Seed generator as random.Random(key) for an int key :
+        init_by_array() with 32 bits words of abs(key).
+        """
+        key = abs(key)
+        initKey = []
+        while key:
+            initKey.append(key & 0xffffffff)
+            key >>= 32
+        if not initKey:
+            initKey = [0]
+
+        # init_genrand(19650218)
+        mt = [19650218]
+        for i in range(1, self.N):
+            mt.append((1812433253 * (mt[i - 1] ^ (mt[i - 1] >> 30)) + i)
+                      & 0xffffffff)
+
+        i = 1
+        j = 0
+        for __ in range(max(self.N, len(initKey))):
+            mt[i] = (((mt[i] ^ ((mt[i - 1] ^ (mt[i - 1] >> 30)) * 1664525))
+                      + initKey[j] + j) & 0xffffffff)
+            i += 1
+            j += 1
+            if i >= self.N:
+                mt[0] = mt[self.N - 1]
+                i = 1
+            if j >= len(initKey):
+                j = 0
+        for __ in range(self.N - 1):
+            mt[i] = (((mt[i] ^ ((mt[i - 1] ^ (mt[i - 1] >> 30)) * 1566083941))
+                      - i) & 0xffffffff)
+            i += 1
+            if i >= self.N:
+                mt[0] = mt[self.N - 1]
+                i = 1
+        mt[0] = 0x80000000
+
+        # Position N : first word will twist the state
+        importNumpy()
+        self.bitGenerator = numpy.random.MT19937()
+        self.bitGenerator.state = {
+            'bit_generator': 'MT19937',
+            'state': {'key': numpy.array(mt, dtype=numpy.uint32),
+                      'pos': self.N}}
+
+    def words(self, count):
+        """ Return array of next count 32 bits words """
+        return self.bitGenerator.random_raw(count)
+
+def encodingIndexesNumpy(key, nbState, nbChar):
+    """
+    Return random tables of encodingIndexes() computed with numpy,
+    consuming words of generator as module random :
+    - choice(seq) : _randbelow(n) keeps first getrandbits(k) < n,
+      getrandbits(k) = word >> (32 - k), k = n.bit_length();
+    - shuffle(x) : for i from len(x)-1 to 1, swap x[i] and x[_randbelow(i+1)].
+    All TT draws are done at once, shuffles stay sequential.
+    """
+    twister = NumpyMersenneTwister(key)
+    nbNeeded = nbState * nbChar
+    shift = 32 - nbState.bit_length()
+    acceptRate = nbState / (1 << nbState.bit_length())
+    draws = []
+    while True:
+        words = twister.words(int(nbNeeded / acceptRate * 1.05) + twister.N)
+        candidates = words >> shift
+        accepted = candidates < nbState
+        nbAccepted = numpy.cumsum(accepted)
+        if nbAccepted[-1] >= nbNeeded:
+            nbUsed = int(numpy.searchsorted(nbAccepted, nbNeeded)) + 1
+            draws.append(candidates[:nbUsed][accepted[:nbUsed]])
+            words = words[nbUsed:]
+            break
+        draws.append(candidates[accepted])
+        nbNeeded -= int(nbAccepted[-1])
+    TT = numpy.concatenate(draws).reshape(nbState, nbChar).tolist()
+
+    # Words left after TT draws, then words generated by blocks
+    blockSize = 2 * nbState * nbChar
+    words = itertools.chain(words.tolist(),
+                            itertools.chain.from_iterable(
+                                iter(lambda: twister.words(blockSize).tolist(),
+                                     None)))
+    swaps = [(i, 32 - (i + 1).bit_length()) for i in range(nbChar - 1, 0, -1)]
+    TC = []
+    listPosition = list(range(nbChar))
+    for __ in range(nbState):
+        for i, shift in swaps:
+            j = next(words) >> shift
+            while j > i:
+                j = next(words) >> shift
+            listPosition[i], listPosition[j] = listPosition[j], listPosition[i]
+        TC.append(tuple(listPosition))
+    return tuple(map(tuple, TT)), tuple(TC)
+
+@functools.lru_cache(maxsize=None)
+def numpyKeyScheduleConforms():
+    """
+    Return True if encodingIndexesNumpy() gives the same tables
+    as module random of this Python version.
+    """
+    return all(encodingIndexesNumpy(key, 5, 40) ==
+               encodingIndexesRandom(key, 5, 40)
+               for key in (0, 123, 2**70 + 1))
+
+def buildMachines(specs, config, maxWorkers=None, cache=None, verbose=False):
+    """
+    Build several ready Mealy machines in parallel with a pool of threads.
+    - specs : iterable of (key, typeEntity, file) tuples (see Mealy())
+    - config : configuration properties read by ConfigParser
+    - maxWorkers : max number of threads (default : see ThreadPoolExecutor)
+    - cache : if not None, MachineCache used to get machines
+    - verbose : True if can print debug message.
+    Return the list of machines in specs order.
+    """
+    def buildMachine(spec):
+        """ Return ready machine for spec """
+        key, typeEntity, file = spec
+        if cache is not None:
+            return cache.get(key, config, typeEntity, file, verbose)
+        mealy = Mealy(key, config, typeEntity, file, verbose)
+        mealy.genAlphabetMatrixes()
+        return mealy
+
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers) \
+            as executor:
+        return list(executor.map(buildMachine, specs))
+
+def fileHash(file, verbose) :
+    """
+    Return SHA-256 hex digest of a file content.
+    - file :  : local fileName
+    - verbose : True if can print debug message.
+    """
+    if verbose :
+        print('\nfileHash :', file)
+
+    digest = hashlib.sha256()
+    try :
+        with open(file, 'rb') as infile:
+            for block in iter(lambda: infile.read(1 << 16), b''):
+                digest.update(block)
+    except IOError as exc:
+        raise ValueError(f'Unable to read file {file}') from exc
+    return digest.hexdigest()
+
+# Number of chars read at once by fileLettersReader()
+LETTERS_READER_CHUNK_SIZE = 1 << 16
+
+def pageLetters(chunks, allowedChars):
+    """
+    Return dict of allowed chars found in chunks, in order of first
+    occurrence (keys only are significant).
+    Stops reading chunks as soon as all allowed chars are found.
+    - chunks : iterable of strings
+    - allowedChars : string of allowed chars
+    """
+    allowedSet = set(allowedChars)
+    lettersInPage = {}
+    for chunk in chunks:
+        # dict.fromkeys() removes duplicates and keeps order
+        for char in dict.fromkeys(chunk):
+            if char in allowedSet and char not in lettersInPage:
+                lettersInPage[char] = None
+        if len(lettersInPage) == len(allowedSet):
+            break
+    return lettersInPage
+
+def fileLettersReader(file, allowedChars, verbose) :
+    """
+    Return dict of allowed chars found in a file, in order of first
+    occurrence (keys only are significant), see pageLetters().
+    File is read by chunks, only until all allowed chars are found.
+    - file :  : local fileName
+    - allowedChars : string of allowed chars
+    - verbose : True if can print debug message.
+    """
+    if verbose :
+        print('\nfileLettersReader :')
+        print('Name of file to get :', file)
+
+    try :
+        with open(file, 'r', encoding='utf8') as infile:
+            chunks = iter(lambda: infile.read(LETTERS_READER_CHUNK_SIZE), '')
+            lettersInPage = pageLetters(chunks, allowedChars)
+    except IOError as exc:
+        raise ValueError(f'Unable to read file {file}') from exc
+
+    if verbose :
+        print('Allowed chars found in file :', "".join(lettersInPage))
+
+    return lettersInPage
 
 def fileReader(file, verbose) :
     """
@@ -301,34 +1332,832 @@ def fileReader(file, verbose) :
 
     return page
 
-def _mealy(alphabet, TT, TC, text, verbose) :
+class CompiledMachine:
+    """
+    One direction of a Mealy machine ready to process texts :
+    TT and TC tables with a char -> position in alphabet dictionary,
+    so that each input char is found in O(1).
+    Texts are converted at once to a buffer of positions in alphabet
+    and output is built as a buffer of code points decoded at the end,
+    so that the state loop only handles small ints.
+    """
+    # True if stateMap() cost does not depend on the number of states
+    # visited : used by _mealyParallel()
+    parallelizable = True
+    # True if getMatrixes() returns tables already built : used by
+    # _mealyMany() to process texts together
+    dense = True
+    # (run of minRunLength positions, pattern of a run) for each run char,
+    # set by setRuns()
+    runSeeds = ()
+    # state * nbChar + position -> run path, see runPath(), set by setRuns()
+    runs = None
+
+    def __init__(self, alphabet, TT, TC):
+        """
+        Compile a machine from :
+        - alphabet : allowed characters for text to encode
+        - TT and TC : Matrix for state machine
+        """
+        self.TT = TT
+        self.TC = TC
+        self.compileAlphabet(alphabet)
+        # Code points of coded chars
+        self.TCCodes = [[ord(codedChar) for codedChar in rowTC]
+                        for rowTC in TC]
+
+    def compileAlphabet(self, alphabet):
+        """
+        Set alphabet and tables used to convert texts :
+        - charIndex : char -> position in alphabet
+        - sanitizer : filter of chars not in alphabet
+        - positionTable : str.translate() table char -> chr(position)
+        """
+        self.alphabet = alphabet
+        self.charIndex = {char: position
+                          for position, char in enumerate(alphabet)}
+        self.sanitizer = Sanitizer(alphabet)
+        self.positionTable = str.maketrans(
+            {char: chr(position) for position, char in enumerate(alphabet)})
+
+    def textPositions(self, text):
+        """
+        Return positions in alphabet of chars of text as a buffer of ints,
+        chars not in alphabet are discarded.
+        Conversion is done by str methods, without a Python loop.
+        """
+        positionsText = self.sanitizer.clean(text).translate(
+            self.positionTable)
+        if len(self.alphabet) <= 256:
+            return positionsText.encode('latin-1')
+        positions = array.array('I')
+        positions.frombytes(positionsText.encode('utf-32-le'))
+        if sys.byteorder != 'little':
+            positions.byteswap()
+        return positions
+
+    @staticmethod
+    def codesText(codes):
+        """
+        Return text of an array('I') of code points
+        """
+        if sys.byteorder != 'little':
+            codes = array.array('I', codes)
+            codes.byteswap()
+        return codes.tobytes().decode('utf-32-le')
+
+    @classmethod
+    def fromMatrixes(cls, alphabet, TT, TC):
+        """
+        Return a new machine built from TT and TC Matrix (lists of lists).
+        """
+        return cls(alphabet, TT, TC)
+
+    @classmethod
+    def fromTable(cls, alphabet, table):
+        """
+        Return a new machine built from a packed table (see CompactMachine).
+        """
+        return cls.fromMatrixes(alphabet,
+                                *CompactMachine(alphabet, table).getMatrixes())
+
+    def getMatrixes(self):
+        """
+        Return TT and TC Matrix as lists of lists.
+        """
+        return self.TT, self.TC
+
+    def getTable(self):
+        """
+        Return TT and TC packed in a flat array (see CompactMachine).
+        """
+        return CompactMachine.fromMatrixes(self.alphabet,
+                                           self.TT, self.TC).table
+
+    def getTransitions(self):
+        """
+        Return TT Matrix as lists of lists.
+        """
+        return self.TT
+
+    def isEmpty(self):
+        """ Return True if alphabet or matrix not set """
+        return not self.alphabet or not self.TT or not self.TC
+
+    def process(self, text, state=0):
+        """
+        Process text from state, chars not in alphabet are discarded.
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        # v3.0 Suppress all characters that are not in alphabet
+        positions = self.textPositions(text)
+        if self.runSeeds:
+            return self.processRuns(positions, state)
+        return self.processPositions(positions, state)
+
+    def processRuns(self, positions, state=0):
+        """
+        Process a buffer of positions in alphabet from state,
+        runs found by findRuns() are processed by processRun().
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        TT = self.TT
+        TCCodes = self.TCCodes
+        output = array.array('I')
+        append = output.append
+        start = 0
+        for runStart, runEnd in self.findRuns(positions):
+            for positionInAlphabet in positions[start:runStart]:
+                append(TCCodes[state][positionInAlphabet])
+                state = TT[state][positionInAlphabet]
+            state = self.processRun(positions[runStart], runEnd - runStart,
+                                    state, output)
+            start = runEnd
+        for positionInAlphabet in positions[start:]:
+            append(TCCodes[state][positionInAlphabet])
+            state = TT[state][positionInAlphabet]
+        return self.codesText(output), state
+
+    def processSegments(self, positions, state=0):
+        """
+        processRuns() for machines without TCCodes : parts of positions
+        between runs are processed by processPositions().
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        outputs = []
+        start = 0
+        for runStart, runEnd in self.findRuns(positions):
+            output, state = self.processPositions(positions[start:runStart],
+                                                  state)
+            outputs.append(output)
+            runOutput = array.array('I')
+            state = self.processRun(positions[runStart], runEnd - runStart,
+                                    state, runOutput)
+            outputs.append(self.codesText(runOutput))
+            start = runEnd
+        output, state = self.processPositions(positions[start:], state)
+        outputs.append(output)
+        return "".join(outputs), state
+
+    def processPositions(self, positions, state=0):
+        """
+        Process a buffer of positions in alphabet from state (see process()).
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        TT = self.TT
+        TCCodes = self.TCCodes
+        output = array.array('I')
+        append = output.append
+        for positionInAlphabet in positions:
+            append(TCCodes[state][positionInAlphabet])
+            state = TT[state][positionInAlphabet]
+        return self.codesText(output), state
+
+    def step(self, state, positionInAlphabet):
+        """
+        Return a tuple : (coded char, next state) for a char from state
+        """
+        return (self.TC[state][positionInAlphabet],
+                self.TT[state][positionInAlphabet])
+
+    def setRuns(self, runChars, minRunLength):
+        """
+        Process runs of at least minRunLength identical chars of runChars
+        in one step with processRun(), 0 : no run processing.
+        Used only for alphabets of at most 256 chars.
+        """
+        positions = [self.charIndex[char] for char in dict.fromkeys(runChars)
+                     if char in self.charIndex]
+        if minRunLength < 2 or len(self.alphabet) > 256:
+            positions = []
+        self.runSeeds = [(bytes([position]) * minRunLength,
+                          re.compile(re.escape(bytes([position])) + b'+'))
+                         for position in positions]
+        self.runs = {}
+
+    def findRuns(self, positions):
+        """
+        Return a sorted list of (start, end) of runs in a buffer
+        of positions, found by bytes.find() for each run char.
+        """
+        runs = []
+        for seed, runPattern in self.runSeeds:
+            runStart = positions.find(seed)
+            while runStart >= 0:
+                runEnd = runPattern.match(positions, runStart).end()
+                runs.append((runStart, runEnd))
+                runStart = positions.find(seed, runEnd)
+        runs.sort()
+        return runs
+
+    def runPath(self, state, positionInAlphabet):
+        """
+        Return the path from state of a run of a char until a state
+        is visited twice : next state function of a char ends in a cycle.
+        Tuple : (states visited + state reached,
+                 array('I') of code points of coded chars, tail length)
+        states[tailLength:-1] is the cycle.
+        """
+        states = []
+        codes = array.array('I')
+        visited = {}
+        while state not in visited:
+            visited[state] = len(states)
+            states.append(state)
+            codedChar, state = self.step(state, positionInAlphabet)
+            codes.append(ord(codedChar))
+        states.append(state)
+        return states, codes, visited[state]
+
+    def processRun(self, positionInAlphabet, length, state, output):
+        """
+        Process a run of length times the same char from state,
+        using the tail and cycle of its run path : code points of
+        coded chars are appended to output, an array('I'), by slicing
+        and repetition. Return state reached at the end of run.
+        """
+        runKey = state * len(self.alphabet) + positionInAlphabet
+        run = self.runs.get(runKey)
+        if run is None:
+            run = self.runs[runKey] = self.runPath(state, positionInAlphabet)
+        states, codes, tailLength = run
+        if length < len(codes):
+            output.extend(codes[:length])
+            return states[length]
+        nbCycles, remainder = divmod(length - tailLength,
+                                     len(codes) - tailLength)
+        cycle = codes[tailLength:]
+        output.extend(codes[:tailLength])
+        output.extend(cycle * nbCycles)
+        output.extend(cycle[:remainder])
+        return states[tailLength + remainder]
+
+    def stateMap(self, text):
+        """
+        Return the effect of text on state : a list giving for each start
+        state the state reached at the end of text, no output is produced.
+        Start states reaching the same state are merged, so that the cost
+        falls quickly to the cost of following only one state.
+        """
+        TT = self.getTransitions()
+        positions = self.textPositions(text)
+        # Current state -> list of start states leading to it
+        groups = {state: [state] for state in range(len(TT))}
+        for numPosition, positionInAlphabet in enumerate(positions):
+            if len(groups) == 1:
+                (state, startStates), = groups.items()
+                for positionInAlphabet in positions[numPosition:]:
+                    state = TT[state][positionInAlphabet]
+                groups = {state: startStates}
+                break
+            newGroups = {}
+            for state, startStates in groups.items():
+                nextState = TT[state][positionInAlphabet]
+                if nextState in newGroups:
+                    newGroups[nextState].extend(startStates)
+                else:
+                    newGroups[nextState] = startStates
+            groups = newGroups
+
+        endStates = [0] * len(TT)
+        for state, startStates in groups.items():
+            for startState in startStates:
+                endStates[startState] = state
+        return endStates
+
+class CompactMachine(CompiledMachine):
+    """
+    Compact layout of a CompiledMachine :
+    TT and TC are packed in one flat array indexed by state * nbChar + pos,
+    each cell contains nextState * nbChar + position of output char.
+    Uses a few bytes per cell instead of two lists of Python objects.
+    Memory option only : decoding a cell costs about 2 times a step of
+    CompiledMachine, measured on 400k chars with 100 states.
+    """
+    # CompiledMachine.__init__() would build TT, TC and TCCodes lists,
+    # the memory this layout avoids : only its alphabet part is called.
+    # pylint: disable=super-init-not-called
+    def __init__(self, alphabet, table):
+        """
+        Compile a machine from :
+        - alphabet : allowed characters for text to encode
+        - table : packed TT and TC, array of nbState * len(alphabet) cells
+        """
+        self.nbChar = len(alphabet)
+        self.table = table
+        self.compileAlphabet(alphabet)
+
+    @classmethod
+    def fromMatrixes(cls, alphabet, TT, TC):
+        """
+        Pack TT and TC Matrix (lists of lists) in a new CompactMachine.
+        """
+        nbChar = len(alphabet)
+        charIndex = {char: position for position, char in enumerate(alphabet)}
+        table = array.array('I')
+        for rowTT, rowTC in zip(TT, TC):
+            table.extend(nextState * nbChar + charIndex[codedChar]
+                         for nextState, codedChar in zip(rowTT, rowTC))
+        return cls(alphabet, table)
+
+    @classmethod
+    def fromTable(cls, alphabet, table):
+        """
+        Return a new machine using a packed table, without copy.
+        """
+        return cls(alphabet, table)
+
+    def __getstate__(self):
+        """
+        Pickle table as an array : tables of a loaded machine
+        file are memoryview on a memory map.
+        """
+        state = self.__dict__.copy()
+        state['table'] = array.array('I', self.table)
+        return state
+
+    def getTable(self):
+        """
+        Return TT and TC packed in a flat array.
+        """
+        return self.table
+
+    def getMatrixes(self):
+        """
+        Return TT and TC Matrix as new lists of lists.
+        """
+        nbChar = self.nbChar
+        TT = []
+        TC = []
+        for start in range(0, len(self.table), nbChar):
+            row = self.table[start:start + nbChar]
+            TT.append([cell // nbChar for cell in row])
+            TC.append([self.alphabet[cell % nbChar] for cell in row])
+        return TT, TC
+
+    def getTransitions(self):
+        """
+        Return TT Matrix as new lists of lists.
+        """
+        nbChar = self.nbChar
+        return [[cell // nbChar for cell in self.table[start:start + nbChar]]
+                for start in range(0, len(self.table), nbChar)]
+
+    def isEmpty(self):
+        """ Return True if alphabet or table not set """
+        return not self.alphabet or not self.table
+
+    def step(self, state, positionInAlphabet):
+        """
+        Return a tuple : (coded char, next state) for a char from state
+        """
+        cell = self.table[state * self.nbChar + positionInAlphabet]
+        return self.alphabet[cell % self.nbChar], cell // self.nbChar
+
+    def processRuns(self, positions, state=0):
+        """ See CompiledMachine.processSegments() """
+        return self.processSegments(positions, state)
+
+    def processPositions(self, positions, state=0):
+        """
+        Process a buffer of positions in alphabet from state (see process()).
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        alphabet = self.alphabet
+        table = self.table
+        nbChar = self.nbChar
+        offset = state * nbChar
+        output = []
+        append = output.append
+        for positionInAlphabet in positions:
+            cell = table[offset + positionInAlphabet]
+            positionOutput = cell % nbChar
+            append(alphabet[positionOutput])
+            offset = cell - positionOutput
+        return "".join(output), offset // nbChar
+
+def keyedRowIndexes(rowKey, state, nbState, nbChar):
+    """
+    Return the row of a state for a machine version 2 as tuples :
+    - TT : next state for each position in alphabet
+    - TC : position in alphabet of coded char for each position,
+      a permutation of positions (Fisher-Yates shuffle)
+    Rows are independent : random words of a row are the output of
+    SHAKE-256(rowKey + state), drawn without bias by rejection.
+    """
+    seed = rowKey + state.to_bytes(8, 'little')
+    nbWords = 2 * nbChar + 16
+    while True:
+        words = struct.unpack(f'<{nbWords}I',
+                              hashlib.shake_256(seed).digest(4 * nbWords))
+        words = iter(words)
+        try:
+            TT = []
+            limit = (1 << 32) - (1 << 32) % nbState
+            while len(TT) < nbChar:
+                word = next(words)
+                if word < limit:
+                    TT.append(word % nbState)
+            TC = list(range(nbChar))
+            for i in range(nbChar - 1, 0, -1):
+                limit = (1 << 32) - (1 << 32) % (i + 1)
+                word = next(words)
+                while word >= limit:
+                    word = next(words)
+                j = word % (i + 1)
+                TC[i], TC[j] = TC[j], TC[i]
+            return tuple(TT), tuple(TC)
+        except StopIteration:
+            # Too many rejections : longer output, same first words
+            nbWords *= 2
+
+class LazyRowMachine(CompiledMachine):
+    """
+    Machine version 2 : the row of TT and TC of a state is derived from key
+    only when a text reaches this state, see keyedRowIndexes().
+    Generated rows are kept in a bounded cache, the oldest are dropped :
+    memory and setup time depend on the states visited, not on nbState.
+    """
+    # stateMap() and getMatrixes() would generate all rows
+    parallelizable = False
+    dense = False
+
+    def __init__(self, alphabet, key, nbState, cacheSize, decoding=False):
+        """
+        Create a machine :
+        - alphabet : allowed characters for text to encode
+        - key : numeric key
+        - nbState : number of states
+        - cacheSize : max number of rows kept
+        - decoding : True for a decoding machine : rows are inverted
+        """
+        self.nbState = nbState
+        self.cacheSize = cacheSize
+        self.decoding = decoding
+        self.rowKey = hashlib.sha256(f'Mealy machine version 2 : {key}'
+                                     .encode('utf8')).digest()
+        # No TT and TC tables : rows are generated by getRow()
+        super().__init__(alphabet, [], [])
+        self.rows = {}
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        """ Pickle without rows cache and lock """
+        state = self.__dict__.copy()
+        state['rows'] = {}
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        """ Unpickle and create a new lock """
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def generateRow(self, state):
+        """
+        Return row of state : (next states list, coded chars list)
+        """
+        TTIndexes, TCIndexes = keyedRowIndexes(self.rowKey, state,
+                                               self.nbState,
+                                               len(self.alphabet))
+        if not self.decoding:
+            return (list(TTIndexes),
+                    [self.alphabet[position] for position in TCIndexes])
+        rowTT = [0] * len(self.alphabet)
+        rowTC = [''] * len(self.alphabet)
+        for char, codedPosition, nextState in zip(self.alphabet, TCIndexes,
+                                                  TTIndexes):
+            rowTT[codedPosition] = nextState
+            rowTC[codedPosition] = char
+        return rowTT, rowTC
+
+    def getRow(self, state):
+        """
+        Return row of state from cache, generated if not in cache.
+        """
+        row = self.rows.get(state)
+        if row is None:
+            row = self.generateRow(state)
+            with self.lock:
+                while len(self.rows) >= self.cacheSize:
+                    del self.rows[next(iter(self.rows))]
+                self.rows[state] = row
+        return row
+
+    def getMatrixes(self):
+        """
+        Return TT and TC Matrix as new lists of lists :
+        all rows are generated.
+        """
+        rows = [self.generateRow(state) for state in range(self.nbState)]
+        return [rowTT for rowTT, __ in rows], [rowTC for __, rowTC in rows]
+
+    def getTransitions(self):
+        """
+        Return TT Matrix as new lists of lists : all rows are generated.
+        """
+        return self.getMatrixes()[0]
+
+    def getTable(self):
+        """
+        Return TT and TC packed in a flat array : all rows are generated.
+        """
+        return CompactMachine.fromMatrixes(self.alphabet,
+                                           *self.getMatrixes()).table
+
+    def isEmpty(self):
+        """ Return True if alphabet not set """
+        return not self.alphabet
+
+    def processPositions(self, positions, state=0):
+        """
+        Process a buffer of positions in alphabet from state (see process()).
+        Return a tuple : (processed text, state reached at the end of text)
+        """
+        rows = self.rows
+        getRow = self.getRow
+        output = []
+        for positionInAlphabet in positions:
+            rowTT, rowTC = rows.get(state) or getRow(state)
+            output.append(rowTC[positionInAlphabet])
+            state = rowTT[positionInAlphabet]
+        return "".join(output), state
+
+    def step(self, state, positionInAlphabet):
+        """
+        Return a tuple : (coded char, next state) for a char from state
+        """
+        rowTT, rowTC = self.getRow(state)
+        return rowTC[positionInAlphabet], rowTT[positionInAlphabet]
+
+    def processRuns(self, positions, state=0):
+        """ See CompiledMachine.processSegments() """
+        return self.processSegments(positions, state)
+
+# Machine used by each process of the pool in _mealyParallel()
+_workerMachine = None
+
+def _initWorker(machine):
+    """ Register machine in a worker process of the pool """
+    global _workerMachine # pylint: disable=global-statement
+    _workerMachine = machine
+
+def _workerStateMap(chunk):
+    """ Return state map of chunk computed by a worker process """
+    return _workerMachine.stateMap(chunk)
+
+def _workerProcess(chunkState):
+    """ Return output of (chunk, start state) computed by a worker process """
+    chunk, state = chunkState
+    return _workerMachine.process(chunk, state)
+
+def _processFile(machine, inputFile, outputFile, chunkSize):
+    """
+    Process inputFile by chunks with machine and write result in outputFile.
+    Return an error message, '' if file is processed.
+    """
+    if os.path.realpath(inputFile) == os.path.realpath(outputFile):
+        return f'{inputFile} : output file is the input file'
+    try:
+        outputDir = os.path.dirname(outputFile)
+        if outputDir:
+            os.makedirs(outputDir, exist_ok=True)
+        with open(inputFile, 'r', encoding='utf8') as infile, \
+             open(outputFile, 'w', encoding='utf8') as outfile:
+            state = 0
+            for chunk in iter(functools.partial(infile.read, chunkSize), ''):
+                output, state = machine.process(chunk, state)
+                outfile.write(output)
+    except (OSError, UnicodeError) as exc:
+        return f'{inputFile} : {exc}'
+    return ''
+
+def _workerProcessFile(inputFile, outputFile, chunkSize):
+    """ Process a file with the machine of a worker process """
+    return _processFile(_workerMachine, inputFile, outputFile, chunkSize)
+
+def _mealyFiles(machine, files, jobs, chunkSize, verbose) :
+    """
+    Process a list of (input file, output file) with the Mealy machine
+    using a pool of jobs processes : the machine is sent once to each
+    process, files are sent by batches.
+    Return a list of error messages, '' for each file processed.
+    """
+    if machine is None or machine.isEmpty() :
+        raise ValueError('Mealy machine not ready, alphabet or matrix not set')
+    if jobs < 1:
+        raise ValueError(f'Number of jobs must be positive : {jobs}')
+    if verbose :
+        print(f'_mealyFiles : {len(files)} files, {jobs} jobs')
+
+    inputFiles = [inputFile for inputFile, __ in files]
+    outputFiles = [outputFile for __, outputFile in files]
+    chunkSizes = itertools.repeat(chunkSize, len(files))
+    if jobs == 1 or len(files) < 2:
+        return [_processFile(machine, inputFile, outputFile, chunkSize)
+                for inputFile, outputFile in files]
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_initWorker, initargs=(machine,)) as executor:
+        return list(executor.map(_workerProcessFile, inputFiles, outputFiles,
+                                 chunkSizes,
+                                 chunksize=max(1, len(files) // (4 * jobs))))
+
+def _mealyParallel(machine, text, jobs, verbose, chunkSize=0) :
+    """
+    Process a text with the Mealy machine using a pool of jobs processes.
+    Result is the same as _mealy().
+    Text is splitted in chunks, then in parallel :
+    1 - the state map of each chunk is computed for all start states,
+        the first chunk is directly processed from state 0;
+    2 - maps are stitched to get the start state of each chunk;
+    3 - each chunk is processed from its start state.
+    Parameters :
+    - machine : CompiledMachine for the direction to use
+    - jobs : number of processes, machines that are not parallelizable
+      are processed by _mealy()
+    - verbose : True if can print debug message.
+    - chunkSize : number of chars of each chunk, default : text splitted
+      in 4 chunks by job
+    """
+    if machine is None or machine.isEmpty() :
+        raise ValueError('Mealy machine not ready, alphabet or matrix not set')
+    if jobs < 1 :
+        raise ValueError(f'Number of jobs must be positive : {jobs}')
+
+    if chunkSize <= 0 :
+        chunkSize = max(1, -(-len(text) // (4 * jobs)))
+    chunks = [text[start:start + chunkSize]
+              for start in range(0, len(text), chunkSize)]
+    if verbose :
+        print('\n_mealyParallel :')
+        print(f'{len(text)} chars in {len(chunks)} chunks for {jobs} jobs')
+    if jobs == 1 or len(chunks) < 2 or not machine.parallelizable :
+        return _mealy(machine, text, verbose)
+
+    import concurrent.futures
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_initWorker, initargs=(machine,)) as executor:
+        firstFuture = executor.submit(_workerProcess, (chunks[0], 0))
+        stateMaps = list(executor.map(_workerStateMap, chunks[1:-1]))
+        firstOutput, state = firstFuture.result()
+        startStates = [state]
+        for stateMap in stateMaps:
+            startStates.append(stateMap[startStates[-1]])
+        outputs = [firstOutput]
+        outputs.extend(output for output, __ in
+                       executor.map(_workerProcess,
+                                    zip(chunks[1:], startStates)))
+    return "".join(outputs)
+
+def _mealyMany(machine, texts, verbose) :
+    """
+    Process a list of independent texts with the Mealy machine.
+    Without numpy, each text is processed by the machine in turn.
+    Lazy machines (not dense) also process texts one by one :
+    their tables would be generated for all states.
+    With numpy, texts are sorted by length and cut in groups processed
+    at once by _mealyGrid() : a group has at least MANY_MIN_TEXTS texts
+    and its grid (longest text * number of texts) has at most
+    MANY_GRID_CELLS chars. Texts longer than MANY_MAX_LENGTH
+    and groups too small are processed one by one.
+    Parameters :
+    - machine : CompiledMachine for the direction to use
+    - texts : list of texts to process
+    - verbose : True if can print debug message.
+    Return the list of processed texts.
+    """
+    if machine is None or machine.isEmpty() :
+        raise ValueError('Mealy machine not ready, alphabet or matrix not set')
+    texts = list(texts)
+    if verbose :
+        print('\n_mealyMany :')
+        print(f'{len(texts)} texts, '
+              f'numpy available : {importNumpy() is not None}')
+    if importNumpy() is None or not machine.dense or not texts :
+        return [machine.process(text)[0] for text in texts]
+
+    results = [None] * len(texts)
+
+    def processGroup(group):
+        """ Process texts of a group of indexes in texts """
+        if len(group) < MANY_MIN_TEXTS:
+            for index in group:
+                results[index] = machine.process(texts[index])[0]
+        else:
+            for index, result in zip(group, _mealyGrid(
+                    machine, [texts[index] for index in group])):
+                results[index] = result
+
+    group = []
+    for index in sorted(range(len(texts)), key=lambda index: len(texts[index])):
+        length = len(texts[index])
+        if length > MANY_MAX_LENGTH:
+            results[index] = machine.process(texts[index])[0]
+            continue
+        if group and length * (len(group) + 1) > MANY_GRID_CELLS:
+            processGroup(group)
+            group = []
+        group.append(index)
+    processGroup(group)
+    return results
+
+def _mealyGrid(machine, texts) :
+    """
+    Process a list of independent texts at once with numpy :
+    - chars of all texts are mapped to their position in alphabet
+      through a code point lookup array, unknown chars are discarded;
+    - texts are sorted by decreasing length and put in columns of a 2-D
+      array, so that texts still running at each step are the first ones;
+    - at each step, states of all running texts are updated at once
+      by fancy indexing in TT and TC packed in one array.
+    Return the list of processed texts.
+    """
+    # TT and TC packed in one array :
+    # cell = (nextState * nbChar) << shift | position of output char
+    nbChar = len(machine.alphabet)
+    TT, TC = machine.getMatrixes()
+    charIndex = machine.charIndex
+    shift = nbChar.bit_length()
+    dtype = (numpy.int32 if (len(TT) * nbChar) << shift < 2**31
+             else numpy.int64)
+    table = ((numpy.array(TT, dtype=dtype) * nbChar) << shift |
+             numpy.array([[charIndex[codedChar] for codedChar in row]
+                          for row in TC], dtype=dtype)).ravel()
+    alphabetCodes = numpy.array([ord(char) for char in machine.alphabet],
+                                dtype=numpy.uint32)
+
+    # Position in alphabet of all chars, -1 for unknown chars :
+    # the last cell of lookup is used for all code points after alphabet ones
+    lookup = numpy.full(int(alphabetCodes.max()) + 2, -1, dtype=dtype)
+    lookup[alphabetCodes] = numpy.arange(nbChar)
+    codes = numpy.frombuffer("".join(texts).encode('utf-32-le',
+                                                   'surrogatepass'),
+                             dtype='<u4')
+    positions = lookup.take(numpy.minimum(codes, len(lookup) - 1))
+    valid = positions >= 0
+    positions = positions[valid]
+
+    # Number of chars kept in each text and position of its first char
+    rawEnds = numpy.cumsum([len(text) for text in texts])
+    validCounts = numpy.concatenate(([0], numpy.cumsum(valid)))
+    lengths = numpy.diff(numpy.concatenate(([0], validCounts[rawEnds])))
+    starts = numpy.cumsum(lengths) - lengths
+
+    # Column of each text in grid : longest texts first
+    order = numpy.argsort(-lengths, kind='stable')
+    columns = numpy.empty_like(order)
+    columns[order] = numpy.arange(len(texts))
+    sortedLengths = lengths[order]
+    maxLength = int(sortedLengths[0])
+    # Index in grid of each char : row = step, column = text
+    cellOfChar = (numpy.arange(len(positions)) -
+                  numpy.repeat(starts, lengths)) * len(texts)
+    cellOfChar += numpy.repeat(columns, lengths)
+    grid = numpy.zeros((maxLength, len(texts)), dtype=dtype)
+    grid.ravel()[cellOfChar] = positions
+
+    # Step all texts at once, offsets = state * nbChar
+    offsets = numpy.zeros(len(texts), dtype=dtype)
+    cells = numpy.zeros(len(texts), dtype=dtype)
+    outputGrid = numpy.zeros_like(grid)
+    mask = (1 << shift) - 1
+    for step in range(maxLength):
+        nbRunning = int(numpy.searchsorted(-sortedLengths, -step, side='left'))
+        running = offsets[:nbRunning]
+        numpy.add(running, grid[step, :nbRunning], out=running)
+        numpy.take(table, running, out=cells[:nbRunning])
+        numpy.bitwise_and(cells[:nbRunning], mask,
+                          out=outputGrid[step, :nbRunning])
+        numpy.right_shift(cells[:nbRunning], shift, out=running)
+
+    outputCodes = alphabetCodes.take(outputGrid.ravel().take(cellOfChar))
+    outputText = outputCodes.astype('<u4').tobytes().decode('utf-32-le')
+    return [outputText[start:start + length]
+            for start, length in zip(starts.tolist(), lengths.tolist())]
+
+def _mealy(machine, text, verbose) :
     """
     Process a text with the Mealy machine
     Parameters :
-    - alphabet : allowed characters for text to encode
-    - TT and TC : Matrix for state machine
+    - machine : CompiledMachine for the direction to use
     - verbose : True if can print debug message.
     """
     if verbose :
         print('\n_mealy :')
         print('text :', text[:20], '...')
-        if len(alphabet) < 5:
-            print('alphabet', alphabet)
+        if machine is not None and len(machine.alphabet) < 5:
+            TT, TC = machine.getMatrixes()
+            print('alphabet', machine.alphabet)
             print('TT :', TT)
             print('TC :', TC)
 
-    if not alphabet or not TT or not TC :
+    if machine is None or machine.isEmpty() :
         raise ValueError('Mealy machine not ready, alphabet or matrix not set')
 
-    # v3.0 Suppress all characters that are not in alphabet
-    textOK = [char for char in text if char in alphabet]
-
-    state = 0
-    OutputText = ""
-    for char in textOK :
-        positionInAlphabet = alphabet.index(char)
-        OutputText += TC[state][positionInAlphabet]
-        state = TT[state][positionInAlphabet]
+    OutputText, __ = machine.process(text)
 
     if verbose :
         print('OutputText :', OutputText[:20], '...')
@@ -0,0 +1,523 @@
+# -*- coding: utf-8 -*-
+"""
+*********************************************************
+Module : MealyServer.py
+Author : Thierry Maillard (TMD)
+Date : 18/10/2026
+
+Role : Cipher / decipher JSON-lines requests with Mealy machines :
+- processRecords() : process request records;
+- processLines() : process request lines in bulk with a pool of processes;
+- MealyServer : asyncio daemon serving requests on a Unix socket
+  or a localhost TCP port, with ready machines kept in cache;
+- MealyClient : client of a MealyServer.
+
+Protocol : one JSON object per line, in utf-8.
+Request : {"id": any value (optional), "op": "cipher" or "decipher",
+           "numkey": int, "stringkey": text key (optional), "text": text}
+Result : {"id": id of request, "text": result}
+         or {"id": id of request, "error": message}
+Results of a connection are written in the order of its requests.
+
+Licence : GPLv3
+Copyright (c) 2015 - 2021 - Thierry Maillard
+
+
+    This file is part of Mealy project.
+
+    Mealy project is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    Mealy project is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Mealy project.  If not, see <http://www.gnu.org/licenses/>.
+*********************************************************
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import re
+import signal
+import socket
+import threading
+
+import Mealy
+
+# Operations of request records
+OPERATIONS = ('cipher', 'decipher')
+
+# Max number of requests of a connection processed at once
+PIPELINE_SIZE = 64
+
+# Seconds given to clients to read their last results when server stops
+STOP_TIMEOUT = 5
+
+# Number of request lines read at once by processLines()
+BULK_BATCH_SIZE = 4096
+
+# Hosts accepted for TCP addresses : server is local only
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+def parseAddress(address):
+    """
+    Return ('tcp', (host, port)) for address "port" or "host:port"
+    with a local host, else ('unix', address) : path of a Unix socket.
+    """
+    address = address.strip()
+    if not address:
+        raise ValueError('Empty server address')
+    match = re.fullmatch(r'(?:\[?([^/\[\]]*?)\]?:)?(\d+)', address)
+    if match is None:
+        return 'unix', address
+    host = match.group(1) or '127.0.0.1'
+    if host not in LOCAL_HOSTS:
+        raise ValueError(f'Server address must be local : {address}')
+    return 'tcp', (host, int(match.group(2)))
+
+def checkRecord(record):
+    """
+    Return (numKey, stringKey, op, text) of a request record,
+    raise ValueError if record is not valid.
+    """
+    if not isinstance(record, dict):
+        raise ValueError('Request must be a JSON object')
+    numKey = record.get('numkey', 0)
+    stringKey = record.get('stringkey') or ""
+    op = record.get('op')
+    text = record.get('text')
+    if not isinstance(numKey, int) or isinstance(numKey, bool):
+        raise ValueError(f'numkey must be an integer : {numKey!r}')
+    if not isinstance(stringKey, str):
+        raise ValueError(f'stringkey must be a string : {stringKey!r}')
+    if op not in OPERATIONS:
+        raise ValueError(f'Unknown op : {op!r}, use cipher or decipher')
+    if not isinstance(text, str):
+        raise ValueError('text must be a string')
+    return numKey, stringKey, op, text
+
+def errorMessage(exc):
+    """ Return message of an exception for the error of a result record """
+    if isinstance(exc, ValueError):
+        return str(exc)
+    return f'{type(exc).__name__} : {exc}'
+
+def parseLine(line):
+    """
+    Return request record of a request line,
+    raise ValueError if line is not valid JSON.
+    """
+    try:
+        return json.loads(line)
+    except (ValueError, RecursionError) as exc: # RecursionError : nesting
+        raise ValueError(f'Invalid JSON : {exc}') from exc
+
+def processRecords(records, config, cache=None, verbose=False, build=True):
+    """
+    Return result records of request records (see module protocol) in order.
+    Machine of consecutive records with the same keys is taken once.
+    - config : configuration properties read by ConfigParser
+    - cache : MachineCache where machines are taken,
+              default Mealy.machineCache
+    - verbose : True if can print debug message.
+    - build : if False, return None as soon as the machine of a record
+              is not in cache.
+    """
+    if cache is None:
+        cache = Mealy.machineCache
+    results = []
+    mealy = None
+    mealyKeys = None
+    for record in records:
+        result = {'id': record.get('id') if isinstance(record, dict) else None}
+        try:
+            numKey, stringKey, op, text = checkRecord(record)
+            if (numKey, stringKey) != mealyKeys:
+                mealy = cache.get(numKey, config,
+                                  'string' if stringKey else 'printable',
+                                  stringKey, verbose, build=build)
+                if mealy is None:
+                    return None
+                mealyKeys = (numKey, stringKey)
+            if op == 'cipher':
+                result['text'] = mealy.cipher(text)
+            else:
+                result['text'] = mealy.deCipher(text)
+        except Exception as exc: # pylint: disable=broad-except
+            result['error'] = errorMessage(exc)
+        results.append(result)
+    return results
+
+def processRecord(record, config, cache=None, verbose=False, build=True):
+    """
+    Return result record of a request record, see processRecords().
+    """
+    results = processRecords([record], config, cache, verbose, build)
+    if results is None:
+        return None
+    return results[0]
+
+def recordKeys(record):
+    """ Return (numKey, stringKey) of a request record, None if not valid """
+    try:
+        numKey, stringKey, __, __ = checkRecord(record)
+    except ValueError:
+        return None
+    return numKey, stringKey
+
+def processLines(lines, config, jobs=1, batchSize=BULK_BATCH_SIZE,
+                 verbose=False):
+    """
+    Generate result records of request lines (see module protocol)
+    in the order of lines, empty lines are skipped.
+    Lines are read by batches of batchSize : records of a batch are
+    grouped by keys, so that a machine is taken once per group,
+    and groups are processed by a pool of jobs processes.
+    Each process keeps machines in its Mealy.machineCache.
+    """
+    if jobs < 1:
+        raise ValueError(f'Number of jobs must be positive : {jobs}')
+    if batchSize < 1:
+        raise ValueError(f'Batch size must be positive : {batchSize}')
+    lines = (line for line in lines if line.strip())
+    with contextlib.ExitStack() as stack:
+        pool = None
+        if jobs > 1:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs, initializer=_initWorker,
+                initargs=(config,)))
+        while True:
+            batch = list(itertools.islice(lines, batchSize))
+            if not batch:
+                return
+            results = [None] * len(batch)
+            groups = collections.defaultdict(list)
+            for index, line in enumerate(batch):
+                try:
+                    record = parseLine(line)
+                except ValueError as exc:
+                    results[index] = {'id': None, 'error': str(exc)}
+                else:
+                    groups[recordKeys(record)].append((index, record))
+            # Groups are split so that all processes have work
+            groupSize = max(1, len(batch) // (4 * jobs))
+            tasks = [group[start:start + groupSize]
+                     for group in groups.values()
+                     for start in range(0, len(group), groupSize)]
+            if verbose:
+                print(f'processLines : {len(batch)} lines, '
+                      f'{len(groups)} keys, {len(tasks)} tasks')
+            records = [[record for __, record in task] for task in tasks]
+            if pool is None:
+                taskResults = (processRecords(taskRecords, config,
+                                              verbose=verbose)
+                               for taskRecords in records)
+            else:
+                taskResults = pool.map(_workerProcessRecords, records)
+            for task, resultsTask in zip(tasks, taskResults):
+                for (index, __), result in zip(task, resultsTask):
+                    results[index] = result
+            yield from results
+
+def resultText(result):
+    """
+    Return result record as a JSON line that can be encoded in UTF-8 :
+    strings with lone surrogates are escaped.
+    """
+    line = json.dumps(result, ensure_ascii=False) + '\n'
+    try:
+        line.encode('utf8')
+    except UnicodeEncodeError:
+        line = json.dumps(result) + '\n'
+    return line
+
+def resultLine(result):
+    """ Return result record encoded as a protocol line """
+    return resultText(result).encode('utf8')
+
+# Configuration of a worker process of the pool
+_workerConfig = None
+
+def _initWorker(config):
+    """ Register configuration in a worker process of the pool """
+    global _workerConfig # pylint: disable=global-statement
+    _workerConfig = config
+
+def _workerProcessRecord(record):
+    """ Return result of a request record computed by a worker process,
+    machines are kept in Mealy.machineCache of the worker """
+    return processRecord(record, _workerConfig)
+
+def _workerProcessRecords(records):
+    """ Return results of request records computed by a worker process """
+    return processRecords(records, _workerConfig)
+
+class MealyServer:
+    """
+    Daemon processing requests of the module protocol received
+    on a Unix socket or a localhost TCP port.
+    Ready machines are kept in a MachineCache : a request for keys
+    already used does not generate tables.
+    Texts of at least inlineSize chars are processed by a pool of
+    jobs processes, shorter ones by the server itself.
+    Requests of a connection are processed concurrently.
+    """
+    def __init__(self, config, address, jobs=1, verbose=False):
+        """
+        - config : configuration properties read by ConfigParser,
+                   section MealyServer
+        - address : Unix socket path, "port" or "host:port" (see parseAddress())
+        - jobs : number of processes of the pool
+        - verbose : True if can print debug message.
+        """
+        if jobs < 1:
+            raise ValueError(f'Number of jobs must be positive : {jobs}')
+        self.kind, self.address = parseAddress(address)
+        cacheSize = config.getint('MealyServer', 'cacheSize', fallback=16)
+        self.inlineSize = config.getint('MealyServer', 'inlineSize',
+                                        fallback=65536)
+        self.maxLineSize = config.getint('MealyServer', 'maxLineSize',
+                                         fallback=1 << 26)
+        if self.inlineSize < 0:
+            raise ValueError(f'inlineSize must be positive : {self.inlineSize}')
+        if self.maxLineSize < 1:
+            raise ValueError('maxLineSize must be positive : '
+                             f'{self.maxLineSize}')
+        self.cache = Mealy.MachineCache(cacheSize)
+        self.config = config
+        self.jobs = jobs
+        self.verbose = verbose
+        self.nbRequests = 0
+        # Set when server accepts connections
+        self.ready = threading.Event()
+        self.loop = None
+        self.stopEvent = None
+        self.pool = None
+        # Connections : task reading requests -> (task of connection, writer)
+        self.clients = {}
+
+    async def processLine(self, line):
+        """ Return result line of a request line """
+        self.nbRequests += 1
+        record = None
+        try:
+            record = parseLine(line)
+            if (isinstance(record, dict)
+                    and isinstance(record.get('text'), str)
+                    and len(record['text']) >= self.inlineSize):
+                result = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, _workerProcessRecord, record)
+            else:
+                result = processRecord(record, self.config, self.cache,
+                                       self.verbose, build=False)
+                if result is None:
+                    # Tables of a new machine are generated in a thread,
+                    # not on the event loop
+                    result = await asyncio.get_running_loop().run_in_executor(
+                        None, processRecord, record, self.config, self.cache,
+                        self.verbose)
+        except Exception as exc: # pylint: disable=broad-except
+            # Invalid JSON, pool broken or shut down
+            result = {'id': record.get('id') if isinstance(record, dict)
+                            else None,
+                      'error': errorMessage(exc)}
+        return resultLine(result)
+
+    async def readRequests(self, reader, pending):
+        """
+        Read request lines of a connection until its end and put tasks
+        processing them in pending queue.
+        """
+        while True:
+            try:
+                line = await reader.readline()
+            except ValueError:
+                future = asyncio.get_running_loop().create_future()
+                future.set_result(resultLine(
+                    {'id': None, 'error': 'Request longer than '
+                                          f'{self.maxLineSize} bytes'}))
+                await pending.put(future)
+                return
+            except ConnectionError:
+                return
+            if not line:
+                return
+            if line.strip():
+                await pending.put(asyncio.create_task(self.processLine(line)))
+
+    @staticmethod
+    async def writeResults(writer, pending):
+        """
+        Write results of pending tasks in order until None is found.
+        Pending tasks are always consumed, even if connection is broken,
+        so that readRequests() is never blocked on a full queue.
+        """
+        broken = False
+        while True:
+            task = await pending.get()
+            if task is None:
+                return
+            try:
+                line = await task
+                if not broken:
+                    writer.write(line)
+                    await writer.drain()
+            except Exception: # pylint: disable=broad-except
+                broken = True
+
+    async def handleClient(self, reader, writer):
+        """ Process requests of a connection, write results in order """
+        if self.stopEvent.is_set(): # Accepted while stopping
+            writer.transport.abort()
+            return
+        pending = asyncio.Queue(PIPELINE_SIZE)
+        writerTask = asyncio.create_task(self.writeResults(writer, pending))
+        readerTask = asyncio.create_task(self.readRequests(reader, pending))
+        # Stopping server cancels readerTask : requests read are answered
+        self.clients[readerTask] = (asyncio.current_task(), writer)
+        try:
+            await asyncio.wait([readerTask])
+        finally:
+            del self.clients[readerTask]
+            await pending.put(None)
+            await writerTask
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+
+    async def serve(self, handleSignals=False):
+        """
+        Serve requests until stop() is called.
+        handleSignals : if True, SIGINT and SIGTERM stop server.
+        """
+        self.loop = asyncio.get_running_loop()
+        self.stopEvent = asyncio.Event()
+        if handleSignals:
+            for signalNumber in (signal.SIGINT, signal.SIGTERM):
+                self.loop.add_signal_handler(signalNumber, self.stopEvent.set)
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.jobs, initializer=_initWorker,
+                initargs=(self.config,)) as self.pool:
+            if self.kind == 'unix':
+                server = await asyncio.start_unix_server(
+                    self.handleClient, self.address, limit=self.maxLineSize)
+            else:
+                server = await asyncio.start_server(
+                    self.handleClient, *self.address, limit=self.maxLineSize)
+                self.address = server.sockets[0].getsockname()[:2]
+            try:
+                async with server:
+                    if self.verbose:
+                        print(f'Serving on {self.kind} {self.address}')
+                    self.ready.set()
+                    await self.stopEvent.wait()
+                    # Requests already received are processed
+                    clients = list(self.clients.items())
+                    for readerTask, _ in clients:
+                        readerTask.cancel()
+                    clientTasks = [task for _, (task, _) in clients]
+                    late = set()
+                    if clientTasks:
+                        _, late = await asyncio.wait(clientTasks,
+                                                     timeout=STOP_TIMEOUT)
+                    # Clients not reading their results are disconnected
+                    for _, (task, writer) in clients:
+                        if task in late:
+                            writer.transport.abort()
+                    await asyncio.gather(*clientTasks,
+                                         return_exceptions=True)
+            finally:
+                self.ready.clear()
+                if self.kind == 'unix' and os.path.exists(self.address):
+                    os.remove(self.address)
+        if self.verbose:
+            print(f'Server stopped after {self.nbRequests} requests')
+
+    def stop(self):
+        """ Stop server, can be called from another thread """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopEvent.set)
+
+class MealyClient:
+    """
+    Client of a MealyServer : requests are sent on one connection
+    kept open until close().
+    """
+    def __init__(self, address, timeout=None):
+        """
+        - address : address of server (see parseAddress())
+        - timeout : max time in s of socket operations, None : no limit
+        """
+        kind, address = parseAddress(address)
+        if kind == 'unix':
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(address)
+        else:
+            self.socket = socket.create_connection(address, timeout)
+        self.file = self.socket.makefile('rwb')
+
+    def call(self, records):
+        """
+        Send request records and return their result records in order.
+        Requests are sent by a thread while results are read.
+        """
+        def sendRecords():
+            """ Send request lines """
+            for record in records:
+                self.file.write(resultLine(record))
+            self.file.flush()
+
+        records = list(records)
+        sender = threading.Thread(target=sendRecords)
+        sender.start()
+        try:
+            results = []
+            for __ in records:
+                line = self.file.readline()
+                if not line:
+                    raise ConnectionError('Connection closed by server')
+                results.append(json.loads(line))
+        finally:
+            sender.join()
+        return results
+
+    def request(self, op, text, numKey, stringKey=""):
+        """ Return result of op on text with the keys,
+        raise ValueError if server returns an error """
+        result = self.call([{'op': op, 'numkey': numKey,
+                             'stringkey': stringKey, 'text': text}])[0]
+        if 'error' in result:
+            raise ValueError(result['error'])
+        return result['text']
+
+    def cipher(self, text, numKey, stringKey=""):
+        """ Return text ciphered by server with the keys """
+        return self.request('cipher', text, numKey, stringKey)
+
+    def deCipher(self, text, numKey, stringKey=""):
+        """ Return text deciphered by server with the keys """
+        return self.request('decipher', text, numKey, stringKey)
+
+    def close(self):
+        """ Close connection """
+        self.file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        self.close()
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+*********************************************************
+Programme benchmark_Mealy.py
+Author : Thierry Maillard (TMD)
+Date : 18/10/2026
+
+Role : Measure performances of Mealy machine.
+Usage : python3 benchmark_Mealy.py
+    Setup time of a machine for growing alphabet sizes :
+    alphabet is extended with extra chars in allowedCharsExt.
+    Ciphering time of whitespace-heavy texts (fixed width columns)
+    with and without run processing (minRunLength).
+    Startup time of run_Mealy.py in batch mode on a short text
+    and its slowest imports (python -X importtime).
+
+Licence : GPLv3
+Copyright (c) 2015 - 2021 - Thierry Maillard
+
+
+    This file is part of Mealy project.
+
+    Mealy project is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later.
+
+    Mealy project is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with Mealy project.  If not, see <http://www.gnu.org/licenses/>.
+*********************************************************
+"""
+
+import configparser
+import os.path
+import random
+import subprocess
+import sys
+import time
+
+import Mealy
+
+def timeIt(function, *args):
+    """ Return (best time of 3 runs in s, result of last run) """
+    bestTime = None
+    for __ in range(3):
+        start = time.perf_counter()
+        result = function(*args)
+        duration = time.perf_counter() - start
+        if bestTime is None or duration < bestTime:
+            bestTime = duration
+    return bestTime, result
+
+def benchSetup(config, nbExtraChars):
+    """
+    Return setup times in s of a machine which alphabet is extended
+    by nbExtraChars chars : (alphabet size, setAlphabet,
+    setMatrixEncoding, setMatrixDecoding)
+    """
+    extraChars = "".join(chr(0x100 + num) for num in range(nbExtraChars))
+    configExt = configparser.RawConfigParser()
+    configExt.read_dict(config)
+    configExt.set("MealyMachine", "allowedCharsExt",
+                  config.get("MealyMachine", "allowedCharsExt") + extraChars)
+
+    mealy = Mealy.Mealy(123, configExt, 'printable')
+    timeAlphabet, mealy.alphabet = timeIt(mealy.setAlphabet)
+
+    def generateEncoding():
+        """ Generate encoding tables, not taken from encodingIndexes() cache """
+        Mealy.encodingIndexes.cache_clear()
+        return mealy.setMatrixEncoding()
+
+    timeEncoding, __ = timeIt(generateEncoding)
+    timeDecoding, __ = timeIt(mealy.setMatrixDecoding)
+    return len(mealy.alphabet), timeAlphabet, timeEncoding, timeDecoding
+
+def columnsText(config, width, size=1000000):
+    """
+    Return a text of about size chars : words of the test file
+    left justified in 4 columns of width chars.
+    """
+    pathTestFile = os.path.join(config.get('Test', 'run_Mealy.path_test'),
+                                config.get('Test', 'run_Mealy.test_file'))
+    with open(pathTestFile, 'r', encoding='utf8') as testFile:
+        words = testFile.read().split()
+    generator = random.Random(width)
+    lines = []
+    nbChars = 0
+    while nbChars < size:
+        line = "".join(generator.choice(words).ljust(width)
+                       for __ in range(4)).rstrip() + "\n"
+        lines.append(line)
+        nbChars += len(line)
+    return "".join(lines)
+
+def benchRuns(config, text, minRunLength):
+    """
+    Return ciphering time in s of text with runs of at least
+    minRunLength chars processed in one step, 0 : no run processing
+    """
+    configRuns = configparser.RawConfigParser()
+    configRuns.read_dict(config)
+    configRuns.set("MealyMachine", "minRunLength", str(minRunLength))
+    mealy = Mealy.Mealy(123, configRuns, 'printable')
+    mealy.genAlphabetMatrixes()
+    timeCipher, __ = timeIt(mealy.cipher, text)
+    return timeCipher
+
+def benchStartup(nbRuns=5):
+    """
+    Return (best wall time in s of run_Mealy.py -b on a short text,
+    list of (cumulated import time in us, module) sorted by decreasing
+    time, from python -X importtime)
+    """
+    command = [sys.executable, '-X', 'importtime', 'run_Mealy.py',
+               '-b', '-n 12', '-t Salut', '-o -']
+    bestTime = None
+    for __ in range(nbRuns):
+        start = time.perf_counter()
+        result = subprocess.run(command, capture_output=True, text=True,
+                                check=True)
+        duration = time.perf_counter() - start
+        if bestTime is None or duration < bestTime:
+            bestTime = duration
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith('import time:') and '|' in line:
+            __, cumulated, module = line.split('|')
+            if cumulated.strip().isdigit():
+                imports.append((int(cumulated), module.strip()))
+    return bestTime, sorted(imports, reverse=True)
+
+def main():
+    """ Run benchmarks and print results """
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    print(f'Setup time (ms) for nbState = '
+          f'{config.getint("MealyMachine", "nbState")}')
+    print(f'{"nbChar":>8} {"setAlphabet":>12} {"encoding":>12} '
+          f'{"decoding":>12}')
+    for nbExtraChars in (0, 100, 300, 700, 1500):
+        nbChar, timeAlphabet, timeEncoding, timeDecoding = \
+            benchSetup(config, nbExtraChars)
+        print(f'{nbChar:8d} {timeAlphabet * 1000:12.2f} '
+              f'{timeEncoding * 1000:12.2f} {timeDecoding * 1000:12.2f}')
+
+    minRunLengths = (0, 32, 64, 128)
+    print('\nCiphering time (ms) of 1 MB of columns by minRunLength')
+    print(f'{"width":>8}' + "".join(f'{length:>10d}'
+                                    for length in minRunLengths))
+    for width in (20, 40, 80, 160):
+        text = columnsText(config, width)
+        print(f'{width:8d}' + "".join(
+            f'{benchRuns(config, text, length) * 1000:10.1f}'
+            for length in minRunLengths))
+
+    startupTime, imports = benchStartup()
+    print(f'\nStartup time (ms) of run_Mealy.py -b : {startupTime * 1000:.1f}')
+    print('Slowest imports (ms, cumulated) :')
+    for cumulated, module in imports[:8]:
+        print(f'{cumulated / 1000:10.1f} {module}')
+    return 0
+
+##################################################
+#to be called as a script
+if __name__ == "__main__":
+    sys.exit(main())
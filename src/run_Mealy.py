@@ -16,10 +16,35 @@ Parameters : without -b parameter, run GUI
     -n or --numkey= value : numeric key (int)
     -s or --stringkey= text : text string used as key
     -f or --filekey= name : local file name used as key
-    -i or --inputFile= name : local file name containing text to process
+    -i or --inputFile= name : local file name containing text to process,
+        - for standard input
     -t or --text= string containing text to process
-    -o or --outputFile= name : local file name where result is written
+    -o or --outputFile= name : local file name where result is written,
+        - for standard output : messages are then printed on standard error
+    --chunk= N : number of chars read and processed at once (default 1048576)
+    --files= spec : process many files : spec is a directory (all its files),
+        a glob pattern or @name of a file listing one file per line.
+        Results are written in -o directory, with the same relative paths.
+        -j N : files are processed by N processes
+    --jsonl : -i file or standard input contains one request per line :
+        {"id": ..., "op": "cipher" or "decipher", "numkey": int,
+         "stringkey": text key (optional), "text": text to process},
+        a result per line {"id": ..., "text": ...} or {"id": ..., "error": ...}
+        is written in -o, in the same order (see MealyServer.py).
+        -j N : requests are processed by N processes
     -d or --decipher : decipher text, else cipher
+    -j or --jobs= N : number of processes used to process text (default 1)
+    -m or --machine= name : compiled machine file for the keys :
+        loaded if it exists, else tables are generated and saved in it
+    --stats[=json] : print time of each phase and counters at the end,
+        as a table or in json
+    --profile= name : json file where states visited, transitions
+        and max runs of chars of the text are written
+    daemon :
+    --serve : serve cipher / decipher requests until SIGINT or SIGTERM,
+        one JSON object per line (see MealyServer.py)
+    --socket= address : Unix socket path, or port or localhost:port for TCP
+        -j N : long texts are processed by N processes
 
 Licence : GPLv3
 Copyright (c) 2015 - 2021 - Thierry Maillard
@@ -46,17 +71,25 @@ import sys
 # Minimum version for Python
 assert sys.version_info >= (3,6)
 
+import collections
 import configparser
+import contextlib
+import functools
 import getopt
-import gettext
-import locale
+import glob
+import io
+import json
 import os
 import os.path
 import platform
+import time
 
-import MealyGUI
+# MealyGUI, gettext and locale are imported by runGUI() only :
+# batch mode startup time is not spent in tkinter and GUI modules
 import Mealy
 
+# Number of chars read and processed at once in batch mode
+CHUNK_SIZE = 1 << 20
 
 def main(argv=None):
     """
@@ -81,24 +114,31 @@ def main(argv=None):
     textString = ""
     cipher = True
     typeEntity = "printable"
-
-    locale.setlocale(locale.LC_ALL, '')
-    localeDirPath = os.path.join(os.path.dirname(sys.argv[0]),
-                                 config.get('Resources', 'LocaleDir'))
-    gettext.install(config.get('Resources', 'MessageNameFile'),
-                    localeDirPath)
+    jobs = 1
+    machineFile = ""
+    statsFormat = ""
+    profileFile = ""
+    chunkSize = CHUNK_SIZE
+    filesSpec = ""
+    serveMode = False
+    jsonlMode = False
+    socketAddress = ""
 
     if argv is None:
         argv = sys.argv
+    # --stats has an optional value, not supported by getopt
+    argv = [("--stats=text" if arg == "--stats" else arg) for arg in argv]
 
     # parse command line options
     try:
         opts, __ = getopt.getopt(
             argv[1:],
-            "hVvbdn:s:f:i:t:o:",
+            "hVvbdn:s:f:i:t:o:j:m:",
             ["help", "version", "verbose", "batch", "decipher",
              "numkey", "stringkey", "filekey",
-             "inputfile", "text", "outputfile"]
+             "inputfile", "text", "outputfile", "jobs=",
+             "machine=", "stats=", "profile=", "chunk=", "files=",
+             "serve", "socket=", "jsonl"]
             )
     except getopt.error as msg:
         print(msg)
@@ -141,95 +181,453 @@ def main(argv=None):
             textString = arg.strip()
         if option in ("-d", "--decipher"):
             cipher = False
-
-    print('Start', \
-        config.get('Version', 'appName'), \
-        config.get('Version', 'number'), \
-        config.get('Version', 'date'))
-    if verbose:
-        print('Parameters :')
-        print('--verbose : verbose mode On')
-        if batchMode:
-            print('--batch : Batch mode')
-            print('--numkey=', numKey)
-            if stringKey:
-                print('--stringkey=', fileKey)
-            if fileKey:
-                print('--fileKey=', fileKey)
-            print('--inputFile=', inputFile)
-            print('--text=', textString)
-            print('--outputFile=', outputFile)
-            if cipher:
-                print('cipher')
+        if option in ("-j", "--jobs"):
+            jobs = int(arg.strip())
+        if option in ("-m", "--machine"):
+            machineFile = arg.strip()
+        if option == "--stats":
+            statsFormat = arg.strip()
+        if option == "--profile":
+            profileFile = arg.strip()
+        if option == "--chunk":
+            chunkSize = int(arg.strip())
+        if option == "--files":
+            filesSpec = arg.strip()
+        if option == "--serve":
+            serveMode = True
+        if option == "--jsonl":
+            jsonlMode = True
+        if option == "--socket":
+            socketAddress = arg.strip()
+
+    # Result written on stdout : messages are printed on stderr
+    resultStream = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr if outputFile == "-"
+                                    else sys.stdout):
+        print('Start', \
+            config.get('Version', 'appName'), \
+            config.get('Version', 'number'), \
+            config.get('Version', 'date'))
+        if verbose:
+            print('Parameters :')
+            print('--verbose : verbose mode On')
+            if batchMode:
+                print('--batch : Batch mode')
+                print('--numkey=', numKey)
+                if stringKey:
+                    print('--stringkey=', fileKey)
+                if fileKey:
+                    print('--fileKey=', fileKey)
+                print('--inputFile=', inputFile)
+                print('--text=', textString)
+                print('--outputFile=', outputFile)
+                print('--jobs=', jobs)
+                if machineFile:
+                    print('--machine=', machineFile)
+                if statsFormat:
+                    print('--stats=', statsFormat)
+                if profileFile:
+                    print('--profile=', profileFile)
+                print('--chunk=', chunkSize)
+                if filesSpec:
+                    print('--files=', filesSpec)
+                if jsonlMode:
+                    print('--jsonl : requests in JSON lines')
+                if cipher:
+                    print('cipher')
+                else:
+                    print('--decipher : decipher')
+            elif serveMode:
+                print('--serve : daemon mode')
+                print('--socket=', socketAddress)
+                print('--jobs=', jobs)
             else:
-                print('--decipher : decipher')
-        else:
-            print('GUI mode...')
-
-    # Check options compatibility
-    if batchMode and ((inputFile and textString) or not (inputFile or textString)):
-        print("Please choose an uniq way to enter text for ciphering\n",
-              "-i and -t options are exclusive !")
-        cr = -1
-
-    # Do the job
-    if cr == 0:
-        if batchMode :
-            text = textString
-            if inputFile:
-                with open(inputFile, 'r', encoding='utf8') as infile:
-                    if verbose :
-                        print(f'Reading text from : {inputFile}')
-                    text = infile.read()
-            cr = runBatch(verbose, config,
-                          numKey, typeEntity, fileKey,
-                          cipher, text, outputFile)
-        else : # GUI Mode
-            MealyGUI.runGUI(verbose, config)
-
-    print('End run_Mealy.py')
+                print('GUI mode...')
+
+        # Check options compatibility
+        if batchMode and [bool(inputFile), bool(textString),
+                          bool(filesSpec)].count(True) != 1:
+            print("Please choose an uniq way to enter text for ciphering\n",
+                  "-i, -t and --files options are exclusive !")
+            cr = -1
+        if jobs < 1:
+            print(f"Number of jobs must be positive : {jobs}")
+            cr = -1
+        if statsFormat not in ("", "text", "json"):
+            print(f"Unknown stats format : {statsFormat}, use text or json")
+            cr = -1
+        if chunkSize < 1:
+            print(f"Chunk size must be positive : {chunkSize}")
+            cr = -1
+        if serveMode and (batchMode or not socketAddress):
+            print("--serve option needs --socket= address "
+                  "and is exclusive with -b")
+            cr = -1
+        if jsonlMode and not (batchMode and inputFile and outputFile):
+            print("--jsonl option needs -b, -i and -o options")
+            cr = -1
+        if filesSpec and outputFile in ("", "-"):
+            print("--files option needs an output directory : -o dir")
+            cr = -1
+
+        # Do the job
+        if cr == 0:
+            if serveMode:
+                cr = runServer(verbose, config, socketAddress, jobs)
+            elif batchMode and jsonlMode:
+                cr = runJsonl(verbose, config, inputFile, outputFile, jobs,
+                              resultStream)
+            elif batchMode and filesSpec:
+                cr = runFiles(verbose, config,
+                              numKey, typeEntity, fileKey,
+                              cipher, filesSpec, outputFile, jobs,
+                              machineFile, chunkSize)
+            elif batchMode :
+                cr = runBatch(verbose, config,
+                              numKey, typeEntity, fileKey,
+                              cipher, textString, outputFile, jobs,
+                              machineFile, statsFormat, profileFile,
+                              inputFile, chunkSize, resultStream)
+            else : # GUI Mode
+                runGUI(verbose, config)
+
+        print('End run_Mealy.py')
     return cr
 
+def runGUI(verbose, config):
+    '''
+    Install locale and translations, then run GUI.
+    '''
+    import gettext
+    import locale
+    import MealyGUI
+
+    locale.setlocale(locale.LC_ALL, '')
+    localeDirPath = os.path.join(os.path.dirname(sys.argv[0]),
+                                 config.get('Resources', 'LocaleDir'))
+    gettext.install(config.get('Resources', 'MessageNameFile'),
+                    localeDirPath)
+    MealyGUI.runGUI(verbose, config)
+
+def runServer(verbose, config, socketAddress, jobs=1):
+    '''
+    Serve cipher / decipher requests on socketAddress until SIGINT or SIGTERM.
+    '''
+    import asyncio
+    import MealyServer
+
+    try:
+        server = MealyServer.MealyServer(config, socketAddress, jobs, verbose)
+    except ValueError as exc:
+        print(f'Problem : {exc}')
+        return 1
+    print(f'Serving on {socketAddress}...')
+    try:
+        asyncio.run(server.serve(handleSignals=True))
+    except OSError as exc:
+        print(f'Problem : can not serve on {socketAddress} :\n{exc}')
+        return 1
+    print(f'Ok : {server.nbRequests} requests processed')
+    return 0
+
+def utf8Stream(stream, stack):
+    '''
+    Return a text stream reading or writing stream in UTF-8 whatever
+    the locale : sys.stdin and sys.stdout are wrapped, the wrapper is
+    flushed and detached when stack is closed, stream stays open.
+    Stream without binary buffer (io.StringIO) is returned as is.
+    '''
+    buffer = getattr(stream, 'buffer', None)
+    if buffer is None:
+        return stream
+    stream.flush()
+    wrapper = io.TextIOWrapper(buffer, encoding='utf8')
+    stack.callback(wrapper.detach)
+    return wrapper
+
+def runJsonl(verbose, config, inputFile, outputFile, jobs=1,
+             resultStream=None):
+    '''
+    Process requests read in JSON lines from inputFile,
+    write results in outputFile in the same order,
+    inputFile, outputFile : - for standard input, resultStream.
+    Machines are reused by requests with the same keys,
+    requests are processed by a pool of jobs processes.
+    '''
+    import MealyServer
+
+    print('Processing requests...')
+    nbRecords = 0
+    nbErrors = 0
+    try:
+        with contextlib.ExitStack() as stack:
+            if inputFile == '-':
+                infile = utf8Stream(sys.stdin, stack)
+            else:
+                infile = stack.enter_context(
+                    open(inputFile, 'r', encoding='utf8'))
+            if outputFile == '-':
+                outfile = utf8Stream(resultStream or sys.stdout, stack)
+            else:
+                outfile = stack.enter_context(
+                    open(outputFile, 'w', encoding='utf8'))
+            for result in MealyServer.processLines(infile, config, jobs,
+                                                   verbose=verbose):
+                outfile.write(MealyServer.resultText(result))
+                nbRecords += 1
+                nbErrors += 'error' in result
+    except (FileNotFoundError, PermissionError) as exc:
+        print(f'Problem : {exc.filename} can not be opened :\n{exc}')
+        return 1
+    print(f'Ok : {nbRecords} requests processed and written in {outputFile}')
+    if nbErrors:
+        print(f'Warning : {nbErrors} requests in error')
+    return 0
+
 def runBatch(verbose, config,
             numKey, typeEntity, fileKey,
-            cipher, text, outputFile):
+            cipher, text, outputFile, jobs=1, machineFile="",
+            statsFormat="", profileFile="", inputFile="",
+            chunkSize=CHUNK_SIZE, resultStream=None):
     '''
     runBatch :
     run Mealy machine in batch according given parameters
     V3.0 : encoding = utf8 + context manager (with)
+    text or inputFile content is processed by chunks of chunkSize chars,
+    state is kept from one chunk to the next, so that memory does not
+    depend on text size.
+    jobs > 1 : whole text is processed by a pool of jobs processes
+    machineFile : compiled machine file loaded if it exists, else created
+    statsFormat : if set, text or json, print timing and counters at the end
+    profileFile : if set, json file where profile of text is written
+    inputFile, outputFile : - for standard input, resultStream
+                            (default standard output)
     return 0 if conversion OK
     '''
 
-    cr = 0
-    mealy = Mealy.Mealy(numKey, config, typeEntity, fileKey, verbose)
-    mealy.genAlphabetMatrixes()
-
-    if mealy.isReady():
-        # Do the job
-        if cipher :
-            print('Cyphering...')
-            result = mealy.cipher(text)
-        else :
-            print('Deciphering...')
-            result = mealy.deCipher(text)
-    else :
-        print("mealy machine not initialized")
-        cr = 1
+    stats = Mealy.MealyStats() if statsFormat else None
+    mealy, cr = getMachine(verbose, config, numKey, typeEntity, fileKey,
+                           machineFile, stats, cipher)
 
     if not cr:
+        # Do the job
+        print('Cyphering...' if cipher else 'Deciphering...')
         try:
-            with open(outputFile, 'w', encoding='utf8') as outfile:
-                if verbose :
-                    print(f'Writing result in : {outputFile}...')
-                outfile.write(result)
-                print('Ok : text processed and written '
-                      f'in {outputFile}')
-        except FileNotFoundError as exc:
-            print(f'Problem : {outputFile} can not be opened :\n{exc}')
+            processChunks(verbose, mealy, cipher, text, inputFile,
+                          outputFile, jobs, profileFile, chunkSize,
+                          resultStream or sys.stdout, stats)
+        except (FileNotFoundError, PermissionError) as exc:
+            print(f'Problem : {exc.filename} can not be opened :\n{exc}')
             cr = 1
 
+    if stats is not None:
+        if statsFormat == "json":
+            print(json.dumps(stats.asDict()))
+        else:
+            print(stats.format())
     return cr
 
+def getMachine(verbose, config, numKey, typeEntity, fileKey,
+               machineFile="", stats=None, cipher=True):
+    '''
+    Return (ready Mealy machine, 0) for the keys, or (machine, 1) on error :
+    loaded from machineFile if it exists, else taken from machine cache
+    and saved in machineFile if given.
+    stats : MealyStats recording setup of the machine
+    cipher : direction used, only its table is loaded from machineFile
+    '''
+    cr = 0
+    if machineFile and os.path.isfile(machineFile):
+        mealy = Mealy.Mealy(numKey, config, typeEntity, fileKey, verbose,
+                            direction='cipher' if cipher else 'decipher')
+        mealy.stats = stats
+        try:
+            mealy.loadMachine(machineFile)
+            if verbose :
+                print(f'Machine loaded from : {machineFile}')
+        except ValueError as exc:
+            print(f'Problem : {machineFile} can not be used :\n{exc}')
+            cr = 1
+    else:
+        mealy = Mealy.machineCache.get(numKey, config, typeEntity,
+                                       fileKey, verbose, stats)
+        if machineFile:
+            try:
+                mealy.saveMachine(machineFile)
+                if verbose :
+                    print(f'Machine saved in : {machineFile}')
+            except ValueError as exc:
+                print(f'Problem : {machineFile} can not be saved :\n{exc}')
+                cr = 1
+
+    if not cr and not mealy.isReady():
+        print("mealy machine not initialized")
+        cr = 1
+    return mealy, cr
+
+def processChunks(verbose, mealy, cipher, text, inputFile, outputFile,
+                  jobs, profileFile, chunkSize, resultStream, stats=None):
+    '''
+    Process text or inputFile content by chunks with a ready Mealy machine
+    and write result in outputFile (see runBatch()).
+    stats : MealyStats where processing of chunks is timed
+    '''
+    with contextlib.ExitStack() as stack:
+        if not inputFile:
+            chunks = [text[start:start + chunkSize]
+                      for start in range(0, len(text), chunkSize)]
+        else:
+            if verbose :
+                print(f'Reading text from : {inputFile}')
+            if inputFile == '-':
+                infile = utf8Stream(sys.stdin, stack)
+            else:
+                infile = stack.enter_context(
+                    open(inputFile, 'r', encoding='utf8'))
+            chunks = iter(functools.partial(infile.read, chunkSize), '')
+        if jobs > 1:
+            # Pool processes need the whole text
+            chunks = ["".join(chunks)]
+
+        if outputFile == '-':
+            outfile = utf8Stream(resultStream, stack)
+        else:
+            outfile = stack.enter_context(
+                open(outputFile, 'w', encoding='utf8'))
+        if verbose :
+            print(f'Writing result in : {outputFile}...')
+
+        session = Mealy.MealySession(mealy, decipher=not cipher, stats=stats)
+        profile = Mealy.MealyProfile() if profileFile else None
+        profileState = 0
+        dropped = 0
+        droppedCounts = collections.Counter()
+        droppedPositions = []
+        offset = 0
+        for chunk in chunks:
+            if jobs > 1:
+                startWall = time.perf_counter()
+                startCpu = time.process_time()
+                result = (mealy.cipherParallel(chunk, jobs) if cipher
+                          else mealy.deCipherParallel(chunk, jobs))
+                if stats is not None and mealy.stats is not stats:
+                    stats.addPhase('cipherParallel' if cipher
+                                   else 'deCipherParallel',
+                                   time.perf_counter() - startWall,
+                                   time.process_time() - startCpu)
+                    stats.countChars(len(chunk), len(result))
+            else:
+                result = session.feed(chunk)
+            outfile.write(result)
+
+            dropReport = mealy.getSanitizer().report(chunk)
+            dropped += dropReport['dropped']
+            droppedCounts.update(dropReport['counts'])
+            droppedPositions.extend(
+                offset + position for position in dropReport['positions']
+                [:Mealy.Sanitizer.NB_SAMPLES - len(droppedPositions)])
+            if profile is not None:
+                profileState = profile.record(session.machine, chunk,
+                                              profileState, offset > 0)
+            offset += len(chunk)
+    print(f'Ok : text processed and written in {outputFile}')
+
+    if profile is not None:
+        with open(profileFile, 'w', encoding='utf8') as outfile:
+            json.dump(profile.asDict(), outfile)
+        if verbose :
+            print(f'Profile written in : {profileFile}')
+
+    # Warn when text is modified : chars not in alphabet are ignored
+    if dropped:
+        print(f"Warning : {dropped} chars not in alphabet ignored :",
+              dict(droppedCounts), 'at positions', droppedPositions, '...')
+
+def listFiles(filesSpec):
+    '''
+    Return (base directory, sorted list of files) for a --files spec :
+    directory, glob pattern or @manifest file listing one file per line.
+    base directory : common directory of files
+    '''
+    if filesSpec.startswith('@'):
+        with open(filesSpec[1:], 'r', encoding='utf8') as manifest:
+            files = [line.strip() for line in manifest if line.strip()]
+    elif os.path.isdir(filesSpec):
+        files = [os.path.join(dirPath, fileName)
+                 for dirPath, __, fileNames in os.walk(filesSpec)
+                 for fileName in fileNames]
+        return filesSpec, sorted(files)
+    else:
+        files = [fileName for fileName in glob.glob(filesSpec, recursive=True)
+                 if os.path.isfile(fileName)]
+    if not files:
+        return "", []
+    baseDir = os.path.commonpath([os.path.dirname(os.path.abspath(fileName))
+                                  for fileName in files])
+    return baseDir, sorted(files)
+
+def runFiles(verbose, config,
+             numKey, typeEntity, fileKey,
+             cipher, filesSpec, outputDir, jobs=1, machineFile="",
+             chunkSize=CHUNK_SIZE):
+    '''
+    Run Mealy machine on many files given by filesSpec (see listFiles()),
+    results are written in outputDir with the same paths relative
+    to the base directory of files. Files are processed by a pool of
+    jobs processes, each one receives the machine once.
+    Print a summary : files, bytes, failures and throughput.
+    return 0 if all files are processed
+    '''
+    try:
+        baseDir, files = listFiles(filesSpec)
+    except OSError as exc:
+        print(f'Problem : {exc.filename} can not be opened :\n{exc}')
+        return 1
+    if not files:
+        print(f'Problem : no file found for {filesSpec}')
+        return 1
+    if verbose :
+        print(f'{len(files)} files found in {baseDir}')
+
+    mealy, cr = getMachine(verbose, config, numKey, typeEntity, fileKey,
+                           machineFile, cipher=cipher)
+    if cr:
+        return cr
+
+    pairs = [(fileName,
+              os.path.join(outputDir, os.path.relpath(
+                  os.path.abspath(fileName), os.path.abspath(baseDir))))
+             for fileName in files]
+    # An output file on its input would truncate it before it is read
+    overwritten = [inputFile for inputFile, outputFile in pairs
+                   if os.path.realpath(inputFile) ==
+                   os.path.realpath(outputFile)]
+    for inputFile in overwritten:
+        print(f'Problem : {inputFile} would be overwritten by its result')
+    if overwritten:
+        print("Please choose an output directory different from inputs")
+        return 1
+
+    sizes = [os.path.getsize(inputFile) if os.path.isfile(inputFile) else 0
+             for inputFile, __ in pairs]
+    print('Cyphering...' if cipher else 'Deciphering...')
+    start = time.perf_counter()
+    if cipher:
+        errors = mealy.cipherFiles(pairs, jobs, chunkSize)
+    else:
+        errors = mealy.deCipherFiles(pairs, jobs, chunkSize)
+    duration = time.perf_counter() - start
+
+    nbBytes = sum(size for size, error in zip(sizes, errors) if not error)
+    failures = [error for error in errors if error]
+    for error in failures:
+        print(f'Problem : {error}')
+    print(f'Files : {len(files)}, bytes : {nbBytes}, '
+          f'failures : {len(failures)}, time : {duration:.2f} s, '
+          f'throughput : {nbBytes / max(duration, 1e-9) / 1e6:.2f} MB/s')
+    print(f'Ok : results written in {outputDir}')
+    return 1 if failures else 0
+
 ##################################################
 #to be called as a script
 if __name__ == "__main__":
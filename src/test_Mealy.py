@@ -35,6 +35,9 @@ Copyright (c) 2021 - Thierry Maillard
 """
 
 import configparser
+import random
+import string
+import sys
 
 import pytest
 import Mealy
@@ -339,3 +342,867 @@ def test_Mealy_Full(inputText):
     # Test decoding
     decodedText = mealy.deCipher(cryptedText)
     assert inputText == decodedText
+
+def _referenceMealy(alphabet, TT, TC, text):
+    """ Original Mealy engine : linear search of each char in alphabet """
+    textOK = [char for char in text if char in alphabet]
+    state = 0
+    OutputText = ""
+    for char in textOK :
+        positionInAlphabet = alphabet.index(char)
+        OutputText += TC[state][positionInAlphabet]
+        state = TT[state][positionInAlphabet]
+    return OutputText
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("key, typeEntity, file", [
+    (123, 'printable', ''),
+    (7, 'string', 'Hello1'),
+    (1, 'test', '')
+    ])
+def test_Mealy_compiled_same_as_reference(key, typeEntity, file, compact):
+    """
+    Test that compiled machine gives the same result as
+    the original engine, for cipher and decipher.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    text = Mealy.fileReader("Mealy.py", False) + "\r\x0b€abcd"
+
+    mealy = Mealy.Mealy(key, config, typeEntity, file, compact=compact)
+    mealy.genAlphabetMatrixes()
+    TT, TC = mealy.getMatrixEncoding()
+    TTd, TCd = mealy.getMatrixDecoding()
+
+    cryptedText = mealy.cipher(text)
+    assert cryptedText == _referenceMealy(mealy.alphabet, TT, TC, text)
+    assert (mealy.deCipher(cryptedText) ==
+            _referenceMealy(mealy.alphabet, TTd, TCd, cryptedText))
+
+def test_Mealy_not_ready():
+    """ Test cipher before genAlphabetMatrixes() """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(1, config, 'test')
+    with pytest.raises(ValueError):
+        mealy.cipher("abcd")
+
+def test_Mealy_compact_matrixes():
+    """
+    Test that compact tables give back the same matrixes
+    and take less memory than lists.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    key = 123
+    typeEntity = 'printable'
+    mealy = Mealy.Mealy(key, config, typeEntity)
+    mealy.genAlphabetMatrixes()
+    mealyCompact = Mealy.Mealy(key, config, typeEntity, compact=True)
+    mealyCompact.genAlphabetMatrixes()
+
+    assert isinstance(mealyCompact.machineEncoding, Mealy.CompactMachine)
+    assert mealy.getMatrixEncoding() == mealyCompact.getMatrixEncoding()
+    assert mealy.getMatrixDecoding() == mealyCompact.getMatrixDecoding()
+
+    table = mealyCompact.machineEncoding.table
+    nbState = config.getint("MealyMachine", "nbState")
+    assert len(table) == nbState * len(mealy.alphabet)
+    TT, __ = mealy.getMatrixEncoding()
+    listsSize = sum(sys.getsizeof(row) for row in TT) * 2
+    assert table.itemsize * len(table) < listsSize
+
+@pytest.mark.parametrize("chunkSize", [1, 7, 1000, 100000])
+def test_MealySession_chunks(chunkSize):
+    """
+    Test that ciphering / deciphering a text in chunks gives
+    the same results as one shot methods.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    key = 123
+    typeEntity = 'printable'
+    text = Mealy.fileReader("Mealy.py", False)
+    chunks = [text[start:start + chunkSize]
+              for start in range(0, len(text), chunkSize)]
+
+    mealy = Mealy.Mealy(key, config, typeEntity)
+    mealy.genAlphabetMatrixes()
+    cryptedText = mealy.cipher(text)
+
+    session = Mealy.MealySession(mealy)
+    assert "".join(session.feed(chunk) for chunk in chunks) == cryptedText
+    session.reset()
+    assert session.feed(text) == cryptedText
+
+    assert "".join(mealy.cipherStream(chunks)) == cryptedText
+    cryptedChunks = [cryptedText[start:start + chunkSize]
+                     for start in range(0, len(cryptedText), chunkSize)]
+    assert "".join(mealy.deCipherStream(cryptedChunks)) == mealy.deCipher(cryptedText)
+
+def test_MealySession_not_ready():
+    """ Test session on a machine without matrixes """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(1, config, 'test')
+    with pytest.raises(ValueError):
+        Mealy.MealySession(mealy)
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_Mealy_stateMap(compact):
+    """ Test state map of a text against processing from each state """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(123, config, 'printable', compact=compact)
+    mealy.genAlphabetMatrixes()
+    machine = mealy.machineEncoding
+    nbState = config.getint("MealyMachine", "nbState")
+
+    for text in ("", "a", "Salut tout le monde !", "ab€cd" * 50):
+        endStates = machine.stateMap(text)
+        assert endStates == [machine.process(text, state)[1]
+                             for state in range(nbState)]
+
+@pytest.mark.parametrize("jobs, chunkSize", [(1, 0), (2, 0), (3, 1000), (4, 1)])
+def test_Mealy_parallel(jobs, chunkSize):
+    """ Test parallel ciphering / deciphering against serial engine """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    text = Mealy.fileReader("Mealy.py", False)
+    if chunkSize == 1:
+        text = text[:200]
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    cryptedText = mealy.cipher(text)
+    assert mealy.cipherParallel(text, jobs, chunkSize) == cryptedText
+    assert (mealy.deCipherParallel(cryptedText, jobs, chunkSize) ==
+            mealy.deCipher(cryptedText))
+
+def test_Mealy_parallel_bad_jobs():
+    """ Test parallel ciphering with bad number of jobs """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(1, config, 'test')
+    mealy.genAlphabetMatrixes()
+    with pytest.raises(ValueError):
+        mealy.cipherParallel("abcd", 0)
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_Mealy_files(jobs, tmp_path):
+    """ Test ciphering / deciphering many files by a pool of processes """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    texts = [Mealy.fileReader(fileName, False)
+             for fileName in ("Mealy.py", "Mealy.ini", "run_Mealy.py")]
+    texts.append("")
+    files = []
+    for index, text in enumerate(texts):
+        inputFile = tmp_path / f"text{index}.txt"
+        inputFile.write_text(text, encoding='utf8')
+        files.append((str(inputFile), str(tmp_path / "out" / f"{index}.txt")))
+    files.append((str(tmp_path / "none.txt"), str(tmp_path / "none.out")))
+
+    errors = mealy.cipherFiles(files, jobs, chunkSize=1000)
+    assert errors[:-1] == [''] * len(texts)
+    assert 'none.txt' in errors[-1]
+    for text, (__, outputFile) in zip(texts, files):
+        with open(outputFile, encoding='utf8') as resultFile:
+            assert resultFile.read() == mealy.cipher(text)
+
+    decoded = [(outputFile, outputFile + ".dec")
+               for __, outputFile in files[:-1]]
+    assert mealy.deCipherFiles(decoded, jobs) == [''] * len(texts)
+    for text, (__, decodedFile) in zip(texts, decoded):
+        with open(decodedFile, encoding='utf8') as resultFile:
+            assert resultFile.read() == mealy.deCipher(mealy.cipher(text))
+    inputFile = files[0][0]
+    assert 'input file' in mealy.cipherFiles([(inputFile, inputFile)])[0]
+    with open(inputFile, encoding='utf8') as resultFile:
+        assert resultFile.read() == texts[0]
+    with pytest.raises(ValueError):
+        mealy.cipherFiles(files, 0)
+
+@pytest.mark.parametrize("withNumpy", [True, False])
+def test_Mealy_many(withNumpy, monkeypatch):
+    """ Test ciphering / deciphering many texts at once """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    if withNumpy:
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(Mealy, "numpy", None)
+
+    texts = ["", "a", "Salut tout le monde !", "€€€", "ligne 1\nligne 2",
+             "àãáâÀÃÁÂéèêëÉÈÊËîïÎÏùüûÙÜÛôöÔÖ", "hello\r secret\ud800", ""]
+    texts.extend(Mealy.fileReader("Mealy.py", False).splitlines())
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    cryptedTexts = mealy.cipherMany(texts)
+    assert cryptedTexts == [mealy.cipher(text) for text in texts]
+    assert (mealy.deCipherMany(cryptedTexts) ==
+            [mealy.deCipher(text) for text in cryptedTexts])
+    assert mealy.cipherMany([]) == []
+    assert mealy.cipherMany(["", "€"]) == ["", ""]
+
+    # Long texts among short ones, several groups
+    monkeypatch.setattr(Mealy, "MANY_MAX_LENGTH", 60)
+    monkeypatch.setattr(Mealy, "MANY_GRID_CELLS", 2000)
+    monkeypatch.setattr(Mealy, "MANY_MIN_TEXTS", 4)
+    texts.append(Mealy.fileReader("Mealy.ini", False))
+    assert mealy.cipherMany(texts) == [mealy.cipher(text) for text in texts]
+
+def test_MachineCache(tmp_path):
+    """ Test hits, misses and LRU eviction of machines cache """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    cache = Mealy.MachineCache(2)
+    mealy1 = cache.get(1, config, 'printable')
+    assert mealy1.isReady()
+    assert cache.get(1, config, 'printable') is mealy1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    mealy2 = cache.get(1, config, 'string', 'Hello1')
+    assert mealy2 is not mealy1
+    assert cache.get(1, config, 'string', 'Hello2') is not mealy2
+    assert len(cache) == 2
+    # mealy1 is the least recently used : evicted
+    assert cache.get(1, config, 'printable') is not mealy1
+    assert (cache.hits, cache.misses) == (1, 4)
+
+    # Key file : machine is rebuilt if file content changes
+    keyFile = tmp_path / "key.txt"
+    keyFile.write_text("Hello1", encoding='utf8')
+    mealyFile = cache.get(1, config, 'file', str(keyFile))
+    assert cache.get(1, config, 'file', str(keyFile)) is mealyFile
+    keyFile.write_text("Hello2", encoding='utf8')
+    assert cache.get(1, config, 'file', str(keyFile)) is not mealyFile
+
+    # Engine options : machine is rebuilt with other options
+    mealy1 = cache.get(1, config, 'printable')
+    for option, value in (("minRunLength", "64"), ("runChars", "-"),
+                          ("machineVersion", "2"), ("rowCacheSize", "10")):
+        configOption = configparser.RawConfigParser()
+        configOption.read_dict(config)
+        configOption.set("MealyMachine", option, value)
+        mealyOption = cache.get(1, configOption, 'printable')
+        assert mealyOption is not mealy1
+        assert cache.get(1, configOption, 'printable') is mealyOption
+
+    cache.clear()
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (0, 0)
+    with pytest.raises(ValueError):
+        Mealy.MachineCache(0)
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_Mealy_save_load_machine(compact, tmp_path):
+    """ Test compiled machine file : save, load and errors """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    text = Mealy.fileReader("Mealy.py", False)
+    machineFile = str(tmp_path / "machine.bin")
+
+    mealy = Mealy.Mealy(123, config, 'string', 'Hello1')
+    mealy.genAlphabetMatrixes()
+    mealy.saveMachine(machineFile)
+    cryptedText = mealy.cipher(text)
+
+    mealyLoaded = Mealy.Mealy(123, config, 'string', 'Hello1', compact=compact)
+    mealyLoaded.loadMachine(machineFile)
+    assert mealyLoaded.isReady()
+    assert mealyLoaded.alphabet == mealy.alphabet
+    assert mealyLoaded.getMatrixEncoding() == mealy.getMatrixEncoding()
+    assert mealyLoaded.getMatrixDecoding() == mealy.getMatrixDecoding()
+    assert mealyLoaded.cipher(text) == cryptedText
+    assert mealyLoaded.deCipher(cryptedText) == mealy.deCipher(cryptedText)
+    assert mealyLoaded.cipherParallel(text, 2) == cryptedText
+
+    # Other keys
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'string', 'Hello2').loadMachine(machineFile)
+
+    # Corrupted file
+    with open(machineFile, 'r+b') as hFile:
+        hFile.seek(-1, 2)
+        lastByte = hFile.read(1)
+        hFile.seek(-1, 2)
+        hFile.write(bytes([lastByte[0] ^ 1]))
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'string', 'Hello1').loadMachine(machineFile)
+
+    # Not a machine file
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'string', 'Hello1').loadMachine("Mealy.py")
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'string', 'Hello1').loadMachine("XYZXYZ")
+    with pytest.raises(ValueError):
+        Mealy.Mealy(1, config, 'test').saveMachine(machineFile)
+
+def test_setMatrixDecoding_bad_tables():
+    """ Test decoding matrix with bad coding matrix """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(1, config, 'test')
+    mealy.alphabet = mealy.setAlphabet()
+    mealy.setMatrixEncoding()
+    mealy.setMatrixDecoding()
+    TTd, TCd = mealy.getMatrixDecoding()
+    for rowTT, rowTC, rowTTd, rowTCd in zip(mealy.TTe, mealy.TCe, TTd, TCd):
+        assert [rowTCd[mealy.alphabet.index(codedChar)]
+                for codedChar in rowTC] == mealy.alphabet
+        assert [rowTTd[mealy.alphabet.index(codedChar)]
+                for codedChar in rowTC] == rowTT
+
+    # Coded char not in alphabet
+    mealy.TCe[0][0] = 'z'
+    with pytest.raises(ValueError):
+        mealy.setMatrixDecoding()
+
+    # Coded chars are not a permutation of alphabet
+    mealy.TCe[0] = list("aabc")
+    with pytest.raises(ValueError):
+        mealy.setMatrixDecoding()
+
+@pytest.mark.parametrize("compact", [False, True])
+def test_Mealy_direction(compact, tmp_path):
+    """ Test lazy decoding tables and one direction machines """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    text = "Salut tout le monde !"
+    mealy = Mealy.Mealy(123, config, 'printable', compact=compact)
+    mealy.genAlphabetMatrixes()
+    assert mealy.machineDecoding is None, 'decoding tables built too early'
+    cryptedText = mealy.cipher(text)
+    assert mealy.machineDecoding is None, 'decoding tables built by cipher'
+    assert mealy.deCipher(cryptedText) == text
+    assert mealy.machineDecoding is not None
+
+    mealyCipher = Mealy.Mealy(123, config, 'printable', compact=compact,
+                              direction='cipher')
+    mealyCipher.genAlphabetMatrixes()
+    assert mealyCipher.isReady()
+    assert mealyCipher.cipher(text) == cryptedText
+    with pytest.raises(ValueError):
+        mealyCipher.deCipher(cryptedText)
+    assert mealyCipher.machineDecoding is None
+
+    mealyDecipher = Mealy.Mealy(123, config, 'printable', compact=compact,
+                                direction='decipher')
+    mealyDecipher.genAlphabetMatrixes()
+    assert mealyDecipher.isReady()
+    assert mealyDecipher.machineEncoding is None
+    assert mealyDecipher.deCipher(cryptedText) == text
+    assert mealyDecipher.getMatrixDecoding() == mealy.getMatrixDecoding()
+    with pytest.raises(ValueError):
+        mealyDecipher.cipher(text)
+
+    # One direction loaded from a compiled machine file
+    machineFile = str(tmp_path / "machine.bin")
+    mealy.saveMachine(machineFile)
+    mealyDecipher = Mealy.Mealy(123, config, 'printable', compact=compact,
+                                direction='decipher')
+    mealyDecipher.loadMachine(machineFile)
+    assert mealyDecipher.machineEncoding is None
+    assert mealyDecipher.deCipher(cryptedText) == text
+    with pytest.raises(ValueError):
+        mealyDecipher.saveMachine(machineFile)
+
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'printable', direction='both ways')
+
+def test_Mealy_private_random_generator():
+    """
+    Test that tables are the same as with module random generator
+    and that module random generator is not modified.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    key = 123
+    mealy = Mealy.Mealy(key, config, 'printable')
+    mealy.alphabet = mealy.setAlphabet()
+
+    random.seed(4321)
+    expectedRandom = random.random()
+    random.seed(4321)
+    mealy.setMatrixEncoding()
+    assert random.random() == expectedRandom
+
+    # Tables generated with module random generator as before
+    random.seed(key)
+    TT = [[random.choice(range(mealy.nbState)) for __ in mealy.alphabet]
+          for __ in range(mealy.nbState)]
+    listChar = list(mealy.alphabet)
+    TC = []
+    for __ in range(mealy.nbState):
+        random.shuffle(listChar)
+        TC.append(list(listChar))
+    assert (mealy.TTe, mealy.TCe) == (TT, TC)
+
+def test_buildMachines():
+    """ Test building machines in parallel threads """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    specs = [(key, 'string', stringKey)
+             for key in range(1, 6) for stringKey in ('Hello1', 'Hello2')]
+    machines = Mealy.buildMachines(specs, config, maxWorkers=4)
+    assert len(machines) == len(specs)
+    for (key, typeEntity, file), mealy in zip(specs, machines):
+        expectedMealy = Mealy.Mealy(key, config, typeEntity, file)
+        expectedMealy.genAlphabetMatrixes()
+        assert mealy.getMatrixEncoding() == expectedMealy.getMatrixEncoding()
+
+    cache = Mealy.MachineCache()
+    machines = Mealy.buildMachines(specs, config, cache=cache)
+    assert Mealy.buildMachines(specs, config, cache=cache) == machines
+    assert cache.hits == len(specs)
+
+def _referenceAlphabet(page, allowedChars):
+    """ Original alphabet building """
+    lettersInPage = [char for char in page if char in allowedChars]
+    lettersInPage.extend(allowedChars)
+    alphabet = []
+    for char in lettersInPage:
+        if char not in alphabet:
+            alphabet.extend(char)
+    return alphabet
+
+@pytest.mark.parametrize("fileName", ["Mealy.py", "Mealy.ini", "empty"])
+def test_setAlphabet_file_streaming(fileName, tmp_path, monkeypatch):
+    """
+    Test alphabet built from a file read by chunks is the same
+    as the one built from the whole file.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    if fileName == "empty":
+        fileName = str(tmp_path / "empty.txt")
+        with open(fileName, "w", encoding="utf8"):
+            pass
+    page = Mealy.fileReader(fileName, False)
+
+    for chunkSize in (1, 10, 1 << 16):
+        monkeypatch.setattr(Mealy, "LETTERS_READER_CHUNK_SIZE", chunkSize)
+        mealy = Mealy.Mealy(1, config, 'file', fileName)
+        assert (mealy.setAlphabet() ==
+                _referenceAlphabet(page, mealy.getAllowedChars()))
+
+    mealy = Mealy.Mealy(1, config, 'string', page[:500])
+    assert (mealy.setAlphabet() ==
+            _referenceAlphabet(page[:500], mealy.getAllowedChars()))
+
+def test_encodingIndexes_cache():
+    """
+    Test random tables are reused for string keys with same numeric key
+    and give the same matrixes as without cache.
+    """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    key = 98765
+    Mealy.encodingIndexes.cache_clear()
+    mealy1 = Mealy.Mealy(key, config, 'string', 'Hello1')
+    mealy1.genAlphabetMatrixes()
+    mealy2 = Mealy.Mealy(key, config, 'string', 'Hello2')
+    mealy2.genAlphabetMatrixes()
+    cacheInfo = Mealy.encodingIndexes.cache_info()
+    assert (cacheInfo.hits, cacheInfo.misses) == (1, 1)
+
+    Mealy.encodingIndexes.cache_clear()
+    mealy2Uncached = Mealy.Mealy(key, config, 'string', 'Hello2')
+    mealy2Uncached.genAlphabetMatrixes()
+    assert mealy2.getMatrixEncoding() == mealy2Uncached.getMatrixEncoding()
+    assert mealy1.getMatrixEncoding() != mealy2.getMatrixEncoding()
+
+@pytest.mark.parametrize("nbState, nbChar", [(3, 4), (100, 133), (7, 1000)])
+def test_encodingIndexesNumpy_conformance(nbState, nbChar):
+    """
+    Test numpy key schedule gives the same tables as module random
+    for many keys.
+    """
+    pytest.importorskip("numpy")
+
+    assert Mealy.numpyKeyScheduleConforms()
+    keys = list(range(20)) + [123, 2**31 - 1, 2**32, 2**32 + 1, 2**70 + 12345,
+                              10**40]
+    for key in keys:
+        assert (Mealy.encodingIndexesNumpy(key, nbState, nbChar) ==
+                Mealy.encodingIndexesRandom(key, nbState, nbChar)), \
+               f'Different tables for key {key}'
+
+def test_NumpyMersenneTwister():
+    """ Test words of numpy generator against module random """
+    pytest.importorskip("numpy")
+
+    for key in (0, 1, 123, 2**64 + 3):
+        twister = Mealy.NumpyMersenneTwister(key)
+        generator = random.Random(key)
+        for count in (1, 623, 624, 2000):
+            assert (twister.words(count).tolist() ==
+                    [generator.getrandbits(32) for __ in range(count)])
+
+def test_setMatrixEncoding_without_numpy(monkeypatch):
+    """ Test matrixes are the same with and without numpy """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    # Tables large enough to be generated with numpy when it is installed
+    config.set("MealyMachine", "nbState", "1000")
+
+    mealy = Mealy.Mealy(2021, config, 'printable')
+    mealy.genAlphabetMatrixes()
+
+    Mealy.encodingIndexes.cache_clear()
+    monkeypatch.setattr(Mealy, "numpy", None)
+    mealyNoNumpy = Mealy.Mealy(2021, config, 'printable')
+    mealyNoNumpy.genAlphabetMatrixes()
+    Mealy.encodingIndexes.cache_clear()
+    assert mealy.getMatrixEncoding() == mealyNoNumpy.getMatrixEncoding()
+
+def test_Mealy_version2_lazy_rows():
+    """ Test machine version 2 : rows generated from key on first visit """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    config.set("MealyMachine", "machineVersion", "2")
+    config.set("MealyMachine", "nbState", "100000")
+    config.set("MealyMachine", "rowCacheSize", "50")
+
+    text = Mealy.fileReader("Mealy.py", False)[:3000]
+
+    mealy = Mealy.Mealy(123, config, 'string', 'Hello1')
+    mealy.genAlphabetMatrixes()
+    assert isinstance(mealy.machineEncoding, Mealy.LazyRowMachine)
+    assert not mealy.machineEncoding.rows, 'rows generated too early'
+    cryptedText = mealy.cipher(text)
+    assert cryptedText != text
+    assert len(mealy.machineEncoding.rows) == 50
+    assert mealy.deCipher(cryptedText) == text
+
+    # Same result with an empty cache, in chunks and in parallel
+    mealy2 = Mealy.Mealy(123, config, 'string', 'Hello1')
+    mealy2.genAlphabetMatrixes()
+    assert "".join(mealy2.cipherStream([text[:100], text[100:]])) == cryptedText
+    assert mealy2.cipherParallel(text, 2, 1000) == cryptedText
+
+    # Many texts : rows are not all generated
+    lines = text.splitlines()
+    mealy2.machineEncoding.rows.clear()
+    assert mealy2.cipherMany(lines) == [mealy.cipher(line) for line in lines]
+    assert len(mealy2.machineEncoding.rows) <= 50
+
+    # Other keys give other results
+    mealy3 = Mealy.Mealy(124, config, 'string', 'Hello1')
+    mealy3.genAlphabetMatrixes()
+    assert mealy3.cipher(text) != cryptedText
+
+    with pytest.raises(ValueError):
+        mealy.saveMachine("machine.bin")
+    config.set("MealyMachine", "machineVersion", "1")
+    assert (mealy.getCacheKey() !=
+            Mealy.Mealy(123, config, 'string', 'Hello1').getCacheKey())
+
+def test_Mealy_version2_matrixes():
+    """ Test all rows of machine version 2 against lazy processing """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    config.set("MealyMachine", "machineVersion", "2")
+    config.set("MealyMachine", "nbState", "20")
+
+    mealy = Mealy.Mealy(7, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    TT, TC = mealy.getMatrixEncoding()
+    TTd, TCd = mealy.getMatrixDecoding()
+    assert len(TT) == 20
+    for rowTC in TC:
+        assert sorted(rowTC) == sorted(mealy.alphabet)
+
+    text = "Salut tout le monde !\n" * 20
+    cryptedText = mealy.cipher(text)
+    assert cryptedText == _referenceMealy(mealy.alphabet, TT, TC, text)
+    assert (mealy.deCipher(cryptedText) ==
+            _referenceMealy(mealy.alphabet, TTd, TCd, cryptedText))
+    assert mealy.cipherMany([text, "abc"]) == [cryptedText, mealy.cipher("abc")]
+
+    config.set("MealyMachine", "machineVersion", "3")
+    with pytest.raises(ValueError):
+        Mealy.Mealy(7, config, 'printable')
+
+@pytest.mark.parametrize("alphabet", [
+    list("abc"), list("a-z]^\\"), list(string.printable), []])
+def test_Sanitizer(alphabet):
+    """ Test filter of chars not in alphabet against a Python filter """
+
+    sanitizer = Mealy.Sanitizer(alphabet)
+    text = "a-b]c^z\\é\n€ abc" * 3
+    expected = "".join(char for char in text if char in alphabet)
+    assert sanitizer.clean(text) == expected
+
+    report = sanitizer.report(text)
+    droppedPositions = [position for position, char in enumerate(text)
+                        if char not in alphabet]
+    assert report['dropped'] == len(droppedPositions)
+    assert report['positions'] == droppedPositions[:10]
+    assert sum(report['counts'].values()) == report['dropped']
+    assert sanitizer.report(text, 2)['positions'] == droppedPositions[:2]
+
+def test_Mealy_drop_report():
+    """ Test report of chars ignored by cipher() and deCipher() """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    with pytest.raises(ValueError):
+        mealy.getSanitizer()
+    mealy.genAlphabetMatrixes()
+
+    text = "Noël à 10€ ½ !€"
+    cryptedText, report = mealy.cipher(text, report=True)
+    assert cryptedText == mealy.cipher(text)
+    assert report == {'dropped': 3, 'counts': {'€': 2, '½': 1},
+                      'positions': [9, 11, 14]}
+
+    assert mealy.sanitize(text) == "Noël à 10  !"
+    assert mealy.sanitize(text, report=True) == ("Noël à 10  !", report)
+    assert mealy.deCipher(cryptedText, report=True) == (
+        "Noël à 10  !", {'dropped': 0, 'counts': {}, 'positions': []})
+
+@pytest.mark.parametrize("nbChar", [3, 256, 300])
+@pytest.mark.parametrize("machineClass",
+                         [Mealy.CompiledMachine, Mealy.CompactMachine])
+def test_machine_text_positions(nbChar, machineClass):
+    """ Test buffers of positions and code points against reference engine,
+    with alphabets stored in bytes or in array of ints """
+
+    generator = random.Random(nbChar)
+    alphabet = [chr(code) for code in range(0x20, 0x20 + nbChar)]
+    alphabet[-1] = '€'
+    TT = [[generator.randrange(5) for __ in alphabet] for __ in range(5)]
+    TC = [generator.sample(alphabet, nbChar) for __ in range(5)]
+    machine = machineClass.fromMatrixes(alphabet, TT, TC)
+
+    text = "".join(generator.choice(alphabet) for __ in range(500)) + "\n😀"
+    positions = machine.textPositions(text)
+    assert list(positions) == [alphabet.index(char) for char in text[:-2]]
+    output, state = machine.process(text)
+    assert output == _referenceMealy(alphabet, TT, TC, text)
+    assert machine.process(text[250:], machine.process(text[:250])[1]) == (
+        output[250:], state)
+
+@pytest.mark.parametrize("machineClass",
+                         [Mealy.CompiledMachine, Mealy.CompactMachine])
+def test_machine_runs(machineClass):
+    """ Test runs processed with cycle tables against reference engine """
+
+    generator = random.Random(18)
+    alphabet = list("ab -")
+    TT = [[generator.randrange(7) for __ in alphabet] for __ in range(7)]
+    TC = [generator.sample(alphabet, len(alphabet)) for __ in range(7)]
+    machine = machineClass.fromMatrixes(alphabet, TT, TC)
+    machine.setRuns(" -", 3)
+    reference = machineClass.fromMatrixes(alphabet, TT, TC)
+
+    for state in range(7):
+        states, __, tailLength = machine.runPath(state, 2)
+        assert len(set(states[:-1])) == len(states) - 1
+        assert states[-1] == states[tailLength]
+        for length in range(30):
+            text = "ab" + " " * length + "b--" + "-" * length + "a"
+            assert machine.process(text, state) == reference.process(text,
+                                                                      state)
+            if state == 0:
+                assert machine.process(text)[0] == _referenceMealy(
+                    alphabet, TT, TC, text)
+
+def test_Mealy_runs():
+    """ Test Mealy machine with run processing """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    text = ("Salut" + " " * 40 + "tout le monde\n" + "=" * 80 + "\n\t\t") * 10
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    config.set("MealyMachine", "minRunLength", "4")
+    mealyRuns = Mealy.Mealy(123, config, 'printable')
+    mealyRuns.genAlphabetMatrixes()
+
+    cryptedText = mealy.cipher(text)
+    assert mealyRuns.cipher(text) == cryptedText
+    assert mealyRuns.deCipher(cryptedText) == text
+    assert mealyRuns.getMachineEncoding().runs
+
+    machine = Mealy.LazyRowMachine(mealy.alphabet, 123, 50, 10)
+    machine.setRuns(" =", 4)
+    assert machine.process(text) == Mealy.LazyRowMachine(
+        mealy.alphabet, 123, 50, 10).process(text)
+
+    config.set("MealyMachine", "minRunLength", "-1")
+    with pytest.raises(ValueError):
+        Mealy.Mealy(123, config, 'printable')
+
+def test_Mealy_stats():
+    """ Test timing and counters recorded in MealyStats """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    mealy = Mealy.Mealy(123, config, 'printable')
+    assert mealy.stats is None
+    mealy.genAlphabetMatrixes()
+    cryptedText = mealy.cipher("Noël à 10€ !")
+
+    stats = Mealy.MealyStats()
+    mealyStats = Mealy.Mealy(123, config, 'printable')
+    mealyStats.stats = stats
+    mealyStats.genAlphabetMatrixes()
+    assert mealyStats.cipher("Noël à 10€ !") == cryptedText
+    assert mealyStats.deCipher(cryptedText) == "Noël à 10 !"
+    assert mealyStats.cipherParallel("abc" * 10, 2, 10) == mealy.cipher(
+        "abc" * 10)
+
+    assert list(stats.phases) == ['setAlphabet', 'setMatrixEncoding',
+                                  'cipher', 'setMatrixDecoding', 'deCipher',
+                                  'cipherParallel']
+    for calls, wallTime, cpuTime in stats.phases.values():
+        assert calls == 1
+        assert wallTime >= 0 and cpuTime >= 0
+    assert stats.charsProcessed == 11 + 11 + 30
+    assert stats.charsDropped == 1
+    assert stats.asDict()['phases']['cipher']['calls'] == 1
+    assert 'chars dropped : 1' in stats.format()
+
+    cache = Mealy.MachineCache()
+    stats = Mealy.MealyStats()
+    mealyCached = cache.get(123, config, 'printable', stats=stats)
+    assert cache.get(123, config, 'printable', stats=stats) is mealyCached
+    assert (stats.cacheHits, stats.cacheMisses) == (1, 1)
+    assert list(stats.phases) == ['setAlphabet', 'setMatrixEncoding']
+
+    # Machines in cache are shared : stats stay with each caller
+    assert mealyCached.stats is None
+    otherStats = Mealy.MealyStats()
+    cache.get(123, config, 'printable', stats=otherStats)
+    cache.get(123, config, 'printable')
+    assert mealyCached.stats is None
+    assert (otherStats.cacheHits, otherStats.cacheMisses) == (1, 0)
+    session = Mealy.MealySession(mealyCached, stats=stats)
+    assert session.feed("Noël à 10€ !") == cryptedText
+    mealyCached.cipher("abc")
+    assert stats.phases['cipher'][0] == 1
+    assert stats.charsProcessed == 11 and not otherStats.phases
+
+def test_MealyProfile():
+    """ Test states visited, transitions and runs recorded by MealyProfile """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    mealy = Mealy.Mealy(123, config, 'printable')
+    mealy.genAlphabetMatrixes()
+    TT, __ = mealy.getMatrixEncoding()
+    text = "Salut     tout le monde €!!\n"
+
+    profile = Mealy.MealyProfile()
+    mealy.profile = profile
+    cryptedText = mealy.cipher(text)
+    mealy.profile = None
+    assert mealy.cipher(text) == cryptedText
+    assert profile.nbChars == len(text) - 1
+
+    # Reference : states followed one by one
+    state = 0
+    visits = [0] * len(TT)
+    for char in text.replace('€', ''):
+        visits[state] += 1
+        state = TT[state][mealy.alphabet.index(char)]
+    assert profile.visits == {state: count for state, count
+                              in enumerate(visits) if count}
+    assert sum(profile.transitions.values()) == len(text) - 1
+    assert profile.record(mealy.getMachineEncoding(), "") == 0
+
+    profileDict = profile.asDict()
+    assert profileDict['maxRuns'][' '] == 5
+    assert profileDict['maxRuns']['!'] == 2
+    assert profileDict['maxRuns']['S'] == 1
+    assert profileDict['visits'][0][1] == max(visits)
+
+    # Run across texts given in chunks
+    machine = mealy.getMachineEncoding()
+    chunksProfile = Mealy.MealyProfile()
+    state = chunksProfile.record(machine, "!!!!!!")
+    state = chunksProfile.record(machine, "€!!", state, True)
+    chunksProfile.record(machine, "!", state, True)
+    assert chunksProfile.maxRuns[mealy.alphabet.index('!')] == 9
+    chunksProfile.record(machine, "!" * 8)
+    assert chunksProfile.maxRuns[mealy.alphabet.index('!')] == 9
+
+    numpy = pytest.importorskip("numpy")
+    arrayVisits, transitions, maxRuns = profile.asArrays(len(TT))
+    assert arrayVisits.tolist() == visits
+    assert numpy.array_equal(transitions.sum(axis=1), arrayVisits)
+    assert maxRuns[mealy.alphabet.index(' ')] == 5
@@ -0,0 +1,260 @@
+# coding: utf-8
+"""
+Name : test_MealyServer
+Author : Thierry Maillard (TMD)
+Date : 18/10/2026
+Role : Unit testing of MealyServer with py.test
+Usage : python3 -m pytest test_MealyServer.py
+
+Licence : GPLv3
+Copyright (c) 2021 - Thierry Maillard
+
+   This file is part of Mealy project.
+
+   Mealy project is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Mealy project is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Mealy project.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import configparser
+import json
+import os.path
+import socket
+import threading
+import time
+
+import pytest
+
+import Mealy
+import MealyServer
+
+def test_parseAddress():
+    """ Test Unix socket and localhost TCP addresses """
+    assert MealyServer.parseAddress("/tmp/mealy.sock") == \
+        ('unix', "/tmp/mealy.sock")
+    assert MealyServer.parseAddress("mealy.sock") == ('unix', "mealy.sock")
+    assert MealyServer.parseAddress("8000") == ('tcp', ('127.0.0.1', 8000))
+    assert MealyServer.parseAddress(" localhost:8000 ") == \
+        ('tcp', ('localhost', 8000))
+    assert MealyServer.parseAddress("[::1]:8000") == ('tcp', ('::1', 8000))
+    for address in ("", "example.com:8000", "0.0.0.0:8000"):
+        with pytest.raises(ValueError):
+            MealyServer.parseAddress(address)
+
+def test_processRecord():
+    """ Test results and errors of request records """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    cache = Mealy.MachineCache(2)
+    mealy = Mealy.machineCache.get(12, config, 'printable')
+    mealyString = Mealy.machineCache.get(12, config, 'string', "Hello1")
+    text = "Hello secret world"
+
+    result = MealyServer.processRecord(
+        {'id': 'a', 'op': 'cipher', 'numkey': 12, 'text': text}, config, cache)
+    assert result == {'id': 'a', 'text': mealy.cipher(text)}
+    result = MealyServer.processRecord(
+        {'op': 'decipher', 'numkey': 12, 'text': mealy.cipher(text)},
+        config, cache)
+    assert result == {'id': None, 'text': text}
+    result = MealyServer.processRecord(
+        {'id': 3, 'op': 'cipher', 'numkey': 12, 'stringkey': "Hello1",
+         'text': text}, config, cache)
+    assert result == {'id': 3, 'text': mealyString.cipher(text)}
+    assert len(cache) == 2
+
+    # Machine not in cache is not built
+    record = {'id': 4, 'op': 'cipher', 'numkey': 13, 'text': text}
+    assert MealyServer.processRecord(record, config, cache,
+                                     build=False) is None
+    assert len(cache) == 2 and cache.misses == 2
+    result = MealyServer.processRecord(record, config, cache)
+    assert MealyServer.processRecord(record, config, cache,
+                                     build=False) == result
+
+    for record in ([1, 2], {'id': 1, 'op': 'cipher', 'numkey': 12},
+                   {'id': 1, 'op': 'cipher', 'numkey': "12", 'text': text},
+                   {'id': 1, 'op': 'cipher', 'numkey': True, 'text': text},
+                   {'id': 1, 'op': 'cipher', 'numkey': -1, 'text': text},
+                   {'id': 1, 'op': 'cipher', 'stringkey': 5, 'text': text},
+                   {'id': 1, 'op': 'encode', 'numkey': 1, 'text': text}):
+        result = MealyServer.processRecord(record, config, cache)
+        assert 'error' in result and 'text' not in result
+        assert result['id'] == (1 if isinstance(record, dict) else None)
+
+@pytest.mark.parametrize("jobs, batchSize", [(1, 4096), (1, 7), (2, 7)])
+def test_processLines(jobs, batchSize):
+    """ Test bulk processing of request lines : results in order """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    words = Mealy.fileReader("Mealy.ini", False).split()
+    records = [{'id': index, 'op': ('cipher', 'decipher')[index % 2],
+                'numkey': index % 5, 'stringkey': "Hello1" * (index % 3 == 0),
+                'text': " ".join(words[index:index + 10])}
+               for index in range(100)]
+    lines = [json.dumps(record) + "\n" for record in records]
+    lines[10:10] = ["\n", '{"id": 100, "op"\n', '[100]\n',
+                    '[' * 100000 + '\n']
+    results = list(MealyServer.processLines(lines, config, jobs, batchSize))
+
+    assert len(results) == 103
+    assert 'Invalid JSON' in results[10]['error']
+    assert results[11] == {'id': None, 'error': 'Request must be a JSON object'}
+    assert 'Invalid JSON' in results[12]['error']
+    del results[10:13]
+    for record, result in zip(records, results):
+        assert result == MealyServer.processRecord(record, config)
+    with pytest.raises(ValueError):
+        list(MealyServer.processLines(lines, config, 0))
+
+@pytest.fixture(params=["unix", "tcp"])
+def server(request, tmp_path):
+    """ Running server with a pool for texts of at least 100 chars """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    config.set('MealyServer', 'inlineSize', "100")
+    config.set('MealyServer', 'maxLineSize', "100000")
+
+    address = str(tmp_path / "mealy.sock") if request.param == "unix" else "0"
+    mealyServer = MealyServer.MealyServer(config, address, jobs=2)
+    thread = threading.Thread(target=asyncio.run, args=(mealyServer.serve(),))
+    thread.start()
+    assert mealyServer.ready.wait(10)
+    yield mealyServer
+    mealyServer.stop()
+    thread.join(10)
+    assert not thread.is_alive()
+    if request.param == "unix":
+        assert not os.path.exists(address)
+
+def serverAddress(mealyServer):
+    """ Return address of server for MealyClient """
+    if mealyServer.kind == 'unix':
+        return mealyServer.address
+    return str(mealyServer.address[1])
+
+def test_MealyServer(server):
+    """ Test client requests against Mealy machines """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    texts = ["", "Salut tout le monde !", "€€€ ligne 1\nligne 2",
+             Mealy.fileReader("Mealy.ini", False)]
+    with MealyServer.MealyClient(serverAddress(server), timeout=30) as client:
+        for numKey, stringKey in ((12, ""), (13, ""), (12, "Hello1")):
+            mealy = Mealy.machineCache.get(
+                numKey, config, 'string' if stringKey else 'printable',
+                stringKey)
+            for text in texts:
+                cryptedText = client.cipher(text, numKey, stringKey)
+                assert cryptedText == mealy.cipher(text)
+                assert (client.deCipher(cryptedText, numKey, stringKey) ==
+                        mealy.deCipher(cryptedText))
+        with pytest.raises(ValueError):
+            client.cipher("Salut", -5)
+
+        # Pipelined requests with mixed keys and sizes : results in order
+        records = [{'id': index, 'op': 'cipher', 'numkey': index % 3,
+                    'text': texts[index % len(texts)]}
+                   for index in range(300)]
+        results = client.call(records)
+        assert [result['id'] for result in results] == list(range(300))
+        for record, result in zip(records, results):
+            mealy = Mealy.machineCache.get(record['numkey'], config,
+                                           'printable')
+            assert result['text'] == mealy.cipher(record['text'])
+    assert len(server.cache) == 6
+    assert server.cache.misses == 6
+
+def test_MealyServer_bad_lines(server):
+    """ Test invalid JSON and too long lines """
+    with MealyServer.MealyClient(serverAddress(server), timeout=30) as client:
+        client.file.write(b'{"id": 1, "op": \n\n[1]\n')
+        client.file.flush()
+        assert 'Invalid JSON' in json.loads(client.file.readline())['error']
+        assert json.loads(client.file.readline()) == \
+            {'id': None, 'error': 'Request must be a JSON object'}
+        assert client.cipher("Salut", 1) != "Salut"
+
+        # Too deep nesting and lone surrogate in id
+        client.file.write(b'[' * 50000 + b'\n')
+        client.file.write(b'{"id": "\\ud800", "op": "cipher", "numkey": 1, '
+                          b'"text": "a"}\n')
+        client.file.flush()
+        assert 'Invalid JSON' in json.loads(client.file.readline())['error']
+        result = json.loads(client.file.readline())
+        assert result == {'id': "\ud800", 'text': client.cipher("a", 1)}
+
+        # Connection is closed after a too long line
+        client.file.write(b'"' + b'a' * 200000 + b'"\n')
+        client.file.flush()
+        assert 'longer' in json.loads(client.file.readline())['error']
+        assert client.file.readline() == b''
+
+def test_MealyServer_stop_while_sending(tmp_path, monkeypatch):
+    """ Server stops while a client is sending and not reading results """
+    monkeypatch.setattr(MealyServer, 'STOP_TIMEOUT', 0.5)
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    address = str(tmp_path / "mealy.sock")
+    mealyServer = MealyServer.MealyServer(config, address)
+    serverThread = threading.Thread(target=asyncio.run,
+                                    args=(mealyServer.serve(),))
+    serverThread.start()
+    assert mealyServer.ready.wait(10)
+
+    sending = threading.Event()
+    def sendRequests():
+        """ Send requests until connection is closed """
+        line = (json.dumps({'op': 'cipher', 'numkey': 1, 'text': "Salut"})
+                + "\n").encode('utf8') * 100
+        with MealyServer.MealyClient(address, timeout=10) as client:
+            try:
+                while True:
+                    client.socket.sendall(line)
+                    sending.set()
+            except OSError:
+                pass
+    clientThread = threading.Thread(target=sendRequests, daemon=True)
+    clientThread.start()
+    assert sending.wait(10)
+    while mealyServer.nbRequests == 0:
+        time.sleep(0.01)
+    mealyServer.stop()
+    serverThread.join(10)
+    assert not serverThread.is_alive()
+    clientThread.join(10)
+    assert not clientThread.is_alive()
+
+def test_MealyClient_no_server(tmp_path):
+    """ Test client without server """
+    with pytest.raises(OSError):
+        MealyServer.MealyClient(str(tmp_path / "none.sock"))
+    with socket.socket() as freeSocket:
+        freeSocket.bind(('127.0.0.1', 0))
+        port = freeSocket.getsockname()[1]
+    with pytest.raises(OSError):
+        MealyServer.MealyClient(str(port))
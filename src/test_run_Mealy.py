@@ -34,13 +34,20 @@ Copyright (c) 2021 - Thierry Maillard
    along with Mealy project.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import io
 import os
 import os.path
 import configparser
 import difflib
+import json
+import signal
+import subprocess
+import sys
+import time
 
 import pytest
 
+import MealyServer
 import run_Mealy
 
 @pytest.mark.parametrize( "verbose", [True, False])
@@ -330,3 +337,374 @@ def test_batch_cypher_decypher_2keys_file(verbose):
                                          fromfile=pathTestFileResultString,
                                          tofile=pathTestFileResultFile,
                                          lineterm=''))
+
+def test_batch_cypher_parallel_jobs():
+    """ Batch ciphering with a pool of processes gives same result as serial """
+
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    pathTest = config.get('Test', 'run_Mealy.path_test')
+    print("pathOutput directory =", pathTest)
+
+    # Check test environment
+    assert os.path.isdir(pathTest), f"First create {pathTest} dir !"
+    pathTestFile = os.path.join(pathTest,
+                                config.get('Test', 'run_Mealy.test_file'))
+    assert os.path.isfile(pathTestFile), f"{pathTestFile} must exist"
+    pathTestFileResult = os.path.join(pathTest,
+                                      config.get('Test',
+                                                 'run_Mealy.test_file_result'))
+    pathTestFileResultJobs = os.path.join(pathTest, 'jobs_' +
+                                          config.get('Test',
+                                                 'run_Mealy.test_file_result'))
+
+    progName = "run_Mealy.py"
+    numKey = "123"
+    param = [progName, '-b', '-n ' + numKey,
+             '-i ' + pathTestFile, '-o ' + pathTestFileResult]
+    assert run_Mealy.main(param) == 0
+    param = [progName, '-b', '-n ' + numKey, '-j 3',
+             '-i ' + pathTestFile, '-o ' + pathTestFileResultJobs]
+    assert run_Mealy.main(param) == 0
+
+    with open(pathTestFileResult) as f1, open(pathTestFileResultJobs) as f2:
+        assert f1.read() == f2.read()
+    os.remove(pathTestFileResultJobs)
+
+    # Bad number of jobs
+    param = [progName, '-b', '-n ' + numKey, '-j 0',
+             '-i ' + pathTestFile, '-o ' + pathTestFileResultJobs]
+    assert run_Mealy.main(param) != 0
+
+def test_batch_cypher_machine_file(tmp_path):
+    """ Batch ciphering with a compiled machine file created then loaded """
+
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    pathTest = config.get('Test', 'run_Mealy.path_test')
+    pathTestFile = os.path.join(pathTest,
+                                config.get('Test', 'run_Mealy.test_file'))
+    assert os.path.isfile(pathTestFile), f"{pathTestFile} must exist"
+    pathMachine = str(tmp_path / "machine.bin")
+    pathResults = [str(tmp_path / f"result{num}.txt") for num in range(3)]
+
+    progName = "run_Mealy.py"
+    numKey = "123"
+    param = [progName, '-b', '-n ' + numKey,
+             '-i ' + pathTestFile, '-o ' + pathResults[0]]
+    assert run_Mealy.main(param) == 0
+
+    # First run creates machine file, second one loads it
+    for pathResult in pathResults[1:]:
+        param = [progName, '-b', '-n ' + numKey, '-m ' + pathMachine,
+                 '-i ' + pathTestFile, '-o ' + pathResult]
+        assert run_Mealy.main(param) == 0
+        assert os.path.isfile(pathMachine)
+        with open(pathResults[0]) as f1, open(pathResult) as f2:
+            assert f1.read() == f2.read()
+
+    # Machine file not compiled for these keys
+    param = [progName, '-b', '-n 124', '-m ' + pathMachine,
+             '-i ' + pathTestFile, '-o ' + pathResults[1]]
+    assert run_Mealy.main(param) == 1
+
+    # Machine file loaded for deciphering
+    param = [progName, '-b', '-d', '-n ' + numKey, '-m ' + pathMachine,
+             '-i ' + pathResults[0], '-o ' + pathResults[2]]
+    assert run_Mealy.main(param) == 0
+    with open(pathTestFile) as f1, open(pathResults[2]) as f2:
+        assert f1.read().strip() == f2.read().strip()
+
+    # Machine file can not be written
+    param = [progName, '-b', '-n ' + numKey,
+             '-m ' + str(tmp_path / "none" / "machine.bin"),
+             '-i ' + pathTestFile, '-o ' + pathResults[1]]
+    assert run_Mealy.main(param) == 1
+
+def test_batch_cypher_stats(tmp_path, capsys):
+    """ Batch ciphering with timing and counters printed at the end """
+
+    progName = "run_Mealy.py"
+    pathResult = str(tmp_path / "result.txt")
+    param = [progName, '-b', '-n 125', '-t Hello€ world',
+             '-o ' + pathResult, '--stats=json']
+    assert run_Mealy.main(param) == 0
+    statsLine = [line for line in capsys.readouterr().out.splitlines()
+                 if line.startswith('{')][-1]
+    stats = json.loads(statsLine)
+    assert list(stats['phases']) == ['setAlphabet', 'setMatrixEncoding',
+                                     'cipher']
+    assert stats['phases']['cipher']['calls'] == 1
+    assert stats['charsProcessed'] == 11
+    assert stats['charsDropped'] == 1
+    assert stats['cacheMisses'] == 1
+
+    # Same keys : machine is found in cache
+    param = [progName, '-b', '-d', '-n 125', '-t Hello world',
+             '-o ' + pathResult, '--stats']
+    assert run_Mealy.main(param) == 0
+    output = capsys.readouterr().out
+    assert 'deCipher' in output
+    assert 'setMatrixEncoding' not in output
+    assert 'setMatrixDecoding' in output
+    assert 'machine cache hits : 1, misses : 0' in output
+
+    param = [progName, '-b', '-n 125', '-t Hello world',
+             '-o ' + pathResult, '--stats=xml']
+    assert run_Mealy.main(param) != 0
+
+@pytest.mark.parametrize("chunkSize", [1, 7, 1000000])
+def test_batch_cypher_profile(chunkSize, tmp_path):
+    """ Batch ciphering with profile of text written in a json file,
+    runs are counted across chunks """
+
+    progName = "run_Mealy.py"
+    pathResult = str(tmp_path / "result.txt")
+    pathProfile = str(tmp_path / "profile.json")
+    param = [progName, '-b', '-n 125', '-t Hello   world',
+             '-o ' + pathResult, '--profile=' + pathProfile,
+             f'--chunk={chunkSize}']
+    assert run_Mealy.main(param) == 0
+    with open(pathProfile, encoding='utf8') as profileFile:
+        profile = json.load(profileFile)
+    assert profile['nbChars'] == 13
+    assert sum(count for __, count in profile['visits']) == 13
+    assert profile['maxRuns'][' '] == 3
+
+@pytest.mark.parametrize("chunkSize", [1, 7, 1000000])
+def test_batch_cypher_chunks_stdin_stdout(chunkSize, tmp_path, capsys,
+                                          monkeypatch):
+    """ Batch ciphering by chunks from standard input to standard output,
+    messages are printed on standard error """
+
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+    pathTest = config.get('Test', 'run_Mealy.path_test')
+    pathTestFile = os.path.join(pathTest,
+                                config.get('Test', 'run_Mealy.test_file'))
+    with open(pathTestFile, encoding='utf8') as testFile:
+        text = testFile.read()[:2000]
+
+    progName = "run_Mealy.py"
+    pathResult = str(tmp_path / "result.txt")
+    param = [progName, '-b', '-n 126', '-t ' + text, '-o ' + pathResult]
+    assert run_Mealy.main(param) == 0
+    with open(pathResult, encoding='utf8') as resultFile:
+        cryptedText = resultFile.read()
+    capsys.readouterr()
+
+    monkeypatch.setattr('sys.stdin', io.StringIO(text))
+    param = [progName, '-b', '-n 126', '-i -', '-o -',
+             f'--chunk={chunkSize}']
+    assert run_Mealy.main(param) == 0
+    output = capsys.readouterr()
+    assert output.out == cryptedText
+    assert 'End run_Mealy.py' in output.err
+
+    # Decipher a file by chunks
+    pathDecoded = str(tmp_path / "decoded.txt")
+    param = [progName, '-b', '-d', '-n 126', '-i ' + pathResult,
+             '-o ' + pathDecoded, f'--chunk={chunkSize}']
+    assert run_Mealy.main(param) == 0
+    with open(pathDecoded, encoding='utf8') as decodedFile:
+        assert decodedFile.read() == text.strip()
+
+    param = [progName, '-b', '-n 126', '-i ' + str(tmp_path / "none.txt"),
+             '-o ' + pathDecoded]
+    assert run_Mealy.main(param) == 1
+    param = [progName, '-b', '-n 126', '-i -', '-o -', '--chunk=0']
+    assert run_Mealy.main(param) != 0
+
+def test_batch_stdin_stdout_utf8():
+    """ Standard input and output are in UTF-8 whatever the locale """
+    text = "Salut « àéèç » !\n"
+    env = dict(os.environ, PYTHONIOENCODING='ascii')
+    command = [sys.executable, "run_Mealy.py", '-b', '-n 12', '-i -', '-o -']
+    cryptedText = subprocess.run(command, input=text.encode('utf8'),
+                                 capture_output=True, env=env,
+                                 check=True).stdout
+    result = subprocess.run(command + ['-d'], input=cryptedText,
+                            capture_output=True, env=env, check=True)
+    assert result.stdout.decode('utf8') == text
+
+    request = json.dumps({'id': "é", 'op': 'cipher', 'numkey': 12,
+                          'text': text}, ensure_ascii=False) + "\n"
+    result = subprocess.run(command + ['--jsonl'],
+                            input=request.encode('utf8'),
+                            capture_output=True, env=env, check=True)
+    assert json.loads(result.stdout.decode('utf8')) == \
+        {'id': "é", 'text': cryptedText.decode('utf8')}
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch_cypher_files(jobs, tmp_path):
+    """ Batch ciphering of many files given by directory, glob or manifest """
+
+    texts = {"a.txt": "Salut tout le monde !",
+             "sub/b.txt": "ligne 1\nligne 2\n",
+             "sub/deep/c.txt": "àãáâÀÃÁÂéèêë" * 100,
+             "d.log": ""}
+    inputDir = tmp_path / "in"
+    for name, text in texts.items():
+        (inputDir / name).parent.mkdir(parents=True, exist_ok=True)
+        (inputDir / name).write_text(text, encoding='utf8')
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text(f"{inputDir / 'a.txt'}\n\n{inputDir / 'sub/b.txt'}\n",
+                        encoding='utf8')
+
+    progName = "run_Mealy.py"
+    cryptedDir = tmp_path / "crypted"
+    param = [progName, '-b', '-n 126', f'--files={inputDir}',
+             f'-o {cryptedDir}', f'-j {jobs}', '--chunk=100']
+    assert run_Mealy.main(param) == 0
+    decodedDir = tmp_path / "decoded"
+    param = [progName, '-b', '-d', '-n 126', f'--files={cryptedDir}',
+             f'-o {decodedDir}', f'-j {jobs}']
+    assert run_Mealy.main(param) == 0
+    for name, text in texts.items():
+        assert (cryptedDir / name).read_text(encoding='utf8') != text or \
+            not text
+        assert (decodedDir / name).read_text(encoding='utf8') == text
+
+    globDir = tmp_path / "glob"
+    param = [progName, '-b', '-n 126', f'--files={inputDir}/**/*.txt',
+             f'-o {globDir}', f'-j {jobs}']
+    assert run_Mealy.main(param) == 0
+    assert sorted(str(path.relative_to(globDir))
+                  for path in globDir.rglob('*') if path.is_file()) == \
+        ["a.txt", "sub/b.txt", "sub/deep/c.txt"]
+    assert (globDir / "a.txt").read_text(encoding='utf8') == \
+        (cryptedDir / "a.txt").read_text(encoding='utf8')
+
+    manifestDir = tmp_path / "manifest"
+    param = [progName, '-b', '-n 126', f'--files=@{manifest}',
+             f'-o {manifestDir}']
+    assert run_Mealy.main(param) == 0
+    assert (manifestDir / "sub/b.txt").read_text(encoding='utf8') == \
+        (cryptedDir / "sub/b.txt").read_text(encoding='utf8')
+
+    # Output directory on inputs : refused, inputs unchanged
+    param = [progName, '-b', '-n 126', f'--files={inputDir}',
+             f'-o {inputDir}', f'-j {jobs}']
+    assert run_Mealy.main(param) == 1
+    for name, text in texts.items():
+        assert (inputDir / name).read_text(encoding='utf8') == text
+
+    # Bad uses : no file, missing manifest, no output directory, -i and --files
+    param = [progName, '-b', '-n 126', f'--files={tmp_path}/*.none',
+             f'-o {manifestDir}']
+    assert run_Mealy.main(param) == 1
+    param = [progName, '-b', '-n 126', f'--files=@{tmp_path}/none.txt',
+             f'-o {manifestDir}']
+    assert run_Mealy.main(param) == 1
+    param = [progName, '-b', '-n 126', f'--files={inputDir}']
+    assert run_Mealy.main(param) != 0
+    param = [progName, '-b', '-n 126', f'--files={inputDir}',
+             f'-i {manifest}', f'-o {manifestDir}']
+    assert run_Mealy.main(param) != 0
+
+def test_batch_startup_imports():
+    """ Batch mode must not import GUI modules, tkinter, numpy
+    nor concurrent.futures """
+
+    script = ("import sys, run_Mealy\n"
+              "cr = run_Mealy.main(['run_Mealy.py', '-b', '-n 12', "
+              "'-t Salut', '-o -'])\n"
+              "print(sorted(name for name in ('tkinter', 'MealyGUI', "
+              "'locale', 'numpy', 'concurrent.futures') "
+              "if name in sys.modules), cr, "
+              "file=sys.stderr)")
+    result = subprocess.run([sys.executable, '-c', script],
+                            capture_output=True, text=True, check=True)
+    assert result.stderr.splitlines()[-1] == "[] 0"
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_batch_jsonl(jobs, tmp_path, capsys, monkeypatch):
+    """ Batch processing of requests in JSON lines """
+
+    # read project properties
+    config = configparser.RawConfigParser()
+    config.read('Mealy.ini')
+
+    records = [{'id': index, 'op': 'cipher', 'numkey': index % 4,
+                'text': f'Hello secret world {index}'}
+               for index in range(50)]
+    records.append({'id': 50, 'op': 'cipher', 'numkey': -1, 'text': "a"})
+    pathRequests = tmp_path / "requests.jsonl"
+    pathRequests.write_text("".join(json.dumps(record) + "\n"
+                                    for record in records), encoding='utf8')
+
+    progName = "run_Mealy.py"
+    pathResults = tmp_path / "results.jsonl"
+    param = [progName, '-b', '--jsonl', f'-i {pathRequests}',
+             f'-o {pathResults}', f'-j {jobs}']
+    assert run_Mealy.main(param) == 0
+    output = capsys.readouterr().out
+    assert 'Ok : 51 requests processed' in output
+    assert 'Warning : 1 requests in error' in output
+    results = [json.loads(line) for line in
+               pathResults.read_text(encoding='utf8').splitlines()]
+    assert [result['id'] for result in results] == list(range(51))
+    assert 'error' in results[-1]
+
+    # Decipher results from standard input to standard output
+    decipherRecords = [{'id': result['id'], 'op': 'decipher',
+                        'numkey': record['numkey'], 'text': result['text']}
+                       for record, result in zip(records, results[:-1])]
+    monkeypatch.setattr('sys.stdin', io.StringIO(
+        "".join(json.dumps(record) + "\n" for record in decipherRecords)))
+    param = [progName, '-b', '--jsonl', '-i -', '-o -', f'-j {jobs}']
+    assert run_Mealy.main(param) == 0
+    output = capsys.readouterr()
+    assert [json.loads(line) for line in output.out.splitlines()] == \
+        [{'id': record['id'], 'text': record['text']}
+         for record in records[:-1]]
+    assert 'End run_Mealy.py' in output.err
+
+    param = [progName, '-b', '--jsonl', f'-i {tmp_path / "none.jsonl"}',
+             f'-o {pathResults}']
+    assert run_Mealy.main(param) == 1
+    param = [progName, '-b', '--jsonl', '-t Hello', '-o -']
+    assert run_Mealy.main(param) != 0
+
+    # Too deep nesting and lone surrogate in id
+    pathRequests.write_text('[' * 100000 + '\n' + json.dumps(
+        {'id': "\ud800", 'op': 'cipher', 'numkey': 1, 'text': "a"}) + '\n',
+                            encoding='utf8')
+    param = [progName, '-b', '--jsonl', f'-i {pathRequests}',
+             f'-o {pathResults}', f'-j {jobs}']
+    assert run_Mealy.main(param) == 0
+    assert 'Warning : 1 requests in error' in capsys.readouterr().out
+    results = [json.loads(line) for line in
+               pathResults.read_text(encoding='utf8').splitlines()]
+    assert 'Invalid JSON' in results[0]['error']
+    assert results[1]['id'] == "\ud800" and 'text' in results[1]
+
+def test_serve(tmp_path):
+    """ Daemon mode : serve requests until SIGTERM """
+    progName = "run_Mealy.py"
+    assert run_Mealy.main([progName, '--serve']) != 0
+    assert run_Mealy.main([progName, '--serve', '-b',
+                           f'--socket={tmp_path / "mealy.sock"}']) != 0
+    assert run_Mealy.main([progName, '--serve',
+                           '--socket=example.com:8000']) == 1
+
+    socketPath = str(tmp_path / "mealy.sock")
+    process = subprocess.Popen([sys.executable, progName, '--serve',
+                                f'--socket={socketPath}'],
+                               stdout=subprocess.PIPE, text=True)
+    try:
+        for __ in range(100):
+            if os.path.exists(socketPath):
+                break
+            time.sleep(0.1)
+        with MealyServer.MealyClient(socketPath, timeout=30) as client:
+            cryptedText = client.cipher("Hello secret world", 12)
+            assert client.deCipher(cryptedText, 12) == "Hello secret world"
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, __ = process.communicate(timeout=30)
+    assert process.returncode == 0
+    assert 'Ok : 2 requests processed' in output
+    assert not os.path.exists(socketPath)